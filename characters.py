@@ -39,3 +39,16 @@ class Character(object):
         y_direction = self.current_coord[1] - self.previous_coord[1]
         self.direction = np.array([x_direction, y_direction])
         return self.direction
+
+
+def match_colours(colours, characters):
+    '''
+    Character.is_colour_match of many colours against many characters at once
+    :param colours: array of colours, shape (..., 3)
+    :param characters: list of Character
+    :return: bool array of shape (..., len(characters)), True where the colour is within the bounds of the character
+    '''
+    lower = np.array([character.lower_colour for character in characters])
+    upper = np.array([character.upper_colour for character in characters])
+    colours = np.asarray(colours)[..., np.newaxis, :]
+    return ((colours >= lower) & (colours <= upper)).all(axis=-1)
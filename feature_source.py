@@ -0,0 +1,132 @@
+"""
+    Lazy access to the features of all states as one (number of states, feature length) matrix.
+
+    The matrix lives in a state array file (see state_arrays) and is memory-mapped, so only the rows that are actually
+    used get read. The network inputs (stream/state/*.npy) are consolidated into such a file once, optionally as
+    float32 or uint8 instead of float64 (opt-in, see DEFAULT_FEATURE_DTYPE). highlights_div and compute_div_threshold accept a FeatureSource wherever they
+    accept the features column of a dataframe (see highlights_state_selection.feature_rows).
+"""
+
+import os
+import numpy as np
+from state_arrays import consolidate_state_files, read_header, read_state_array_file
+from highlights_state_selection import list_state_files, load_flat_array
+
+#the inputs are compared in float64 like read_input_files does, float32 and uint8 save memory but change the distances
+#of HIGHLIGHTS-DIV slightly, which can change the selected states
+DEFAULT_FEATURE_DTYPE = 'float64'
+
+
+class FeatureSource(object):
+    '''
+    Features of a list of states, backed by a (possibly memory-mapped) matrix.
+    Indexing with a row returns the materialized feature vector of that row (float32 unless the matrix is float64),
+    rows() materializes a whole block at once.
+    '''
+
+    def __init__(self, states, matrix, scale=None, row_index=None):
+        '''
+        :param states: state index of every row of this source
+        :param matrix: (number of matrix rows, feature length) array, e.g. a np.memmap
+        :param scale: factor to convert stored values into features, e.g. 1/255 for uint8
+        :param row_index: matrix row of every row of this source, None if they are the same
+        '''
+        self.states = np.asarray(states)
+        self.matrix = matrix
+        self.scale = scale
+        self.row_index = row_index
+
+    def __len__(self):
+        return len(self.states)
+
+    def __getitem__(self, row):
+        return self.rows([row])[0]
+
+    @property
+    def feature_length(self):
+        return self.matrix.shape[1]
+
+    def rows(self, rows):
+        '''
+        :param rows: rows of this source
+        :return: (len(rows), feature length) array with their features
+        '''
+        rows = np.asarray(rows, dtype=np.int64)
+        matrix_rows = rows if self.row_index is None else self.row_index[rows]
+        # read in file order, memory-mapped reads are much faster that way
+        order = np.argsort(matrix_rows, kind='stable')
+        dtype = np.float64 if self.matrix.dtype == np.float64 else np.float32
+        features = np.empty((len(rows), self.feature_length), dtype=dtype)
+        features[order] = self.matrix[matrix_rows[order]]
+        if self.scale is not None:
+            features *= self.scale
+        return features
+
+    def blocks(self, block_size):
+        '''
+        :param block_size: number of rows per block
+        :return: generator of (first row, features of the block) in row order
+        '''
+        for start in range(0, len(self), block_size):
+            yield start, self.rows(np.arange(start, min(start + block_size, len(self))))
+
+    def subset(self, states):
+        '''
+        :param states: state indices, all of them have to be in this source
+        :return: FeatureSource whose row i holds the features of states[i], sharing the matrix with this one
+        '''
+        states = np.asarray(states)
+        if len(self.states) == 0:
+            if len(states) > 0:
+                raise KeyError('no features for states ' + str(states[:10]))
+            return FeatureSource(states, self.matrix, self.scale, np.zeros(0, dtype=np.int64))
+        order = np.argsort(self.states, kind='stable')
+        positions = np.searchsorted(self.states, states, sorter=order)
+        positions = np.minimum(positions, len(order) - 1)
+        rows = order[positions]
+        missing = self.states[rows] != states
+        if missing.any():
+            raise KeyError('no features for states ' + str(states[missing][:10]))
+        row_index = rows if self.row_index is None else self.row_index[rows]
+        return FeatureSource(states, self.matrix, self.scale, row_index)
+
+
+def open_feature_source(filename):
+    '''
+    memory-maps a state array file
+    :param filename: path of the file
+    :return: FeatureSource over all states in the file
+    '''
+    _, _, _, metadata = read_header(filename)
+    states, values = read_state_array_file(filename, mmap=True)
+    return FeatureSource(states, values.reshape(len(states), -1), metadata.get('scale'))
+
+
+def quantize(array, dtype):
+    if np.dtype(dtype) == np.uint8:
+        # the inputs are frames scaled to [0, 1]
+        return np.clip(np.rint(array * 255), 0, 255).astype(np.uint8)
+    return array.astype(dtype)
+
+
+def input_feature_filename(path, dtype):
+    return os.path.normpath(path) + '_' + np.dtype(dtype).name + '.bin'
+
+
+def read_input_feature_source(path, dtype=DEFAULT_FEATURE_DTYPE, workers=None, block_size=256):
+    '''
+    lazy replacement of read_input_files. The npy files of path are consolidated into path_<dtype>.bin, states that
+    are already in that file are not read again as long as their npy file did not change.
+    :param path: path to the directory where the npy files are stored
+    :param dtype: dtype in which the inputs are stored, float64 keeps them exact, float32 or uint8 (quantized with a
+    scale of 1/255) save memory
+    :param workers: number of threads used to load the npy files
+    :param block_size: number of npy files that are loaded at once
+    :return: FeatureSource with the flattened inputs of all states
+    '''
+    dtype = np.dtype(dtype)
+    filename = input_feature_filename(path, dtype)
+    metadata = {'scale': 1.0 / 255} if dtype == np.uint8 else None
+    load = lambda name: quantize(load_flat_array(name), dtype)
+    consolidate_state_files(filename, list_state_files(path, '.npy'), load, dtype, metadata, workers, block_size)
+    return open_feature_source(filename)
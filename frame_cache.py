@@ -0,0 +1,120 @@
+"""
+    Process-wide, size-bounded LRU cache of decoded frames and normalised saliency maps.
+
+    The overlay and video stages decode the same files several times: every saliency map once per frame of its state,
+    and the frames of states that are in several summaries (the context of the HIGHLIGHTS-DIV summary and of the random
+    summaries overlap) once per summary. Entries are keyed by (artifact, state, subframe), where the artifact names the
+    folder and the decoding, and are invalidated when the modification time of their file changes. The size is a limit
+    per process: pools of worker processes split the size of the parent's cache among their workers (worker_budget).
+"""
+
+import collections
+import os
+import threading
+
+DEFAULT_MAX_BYTES = 512 * 2**20
+
+
+class FrameCache(object):
+    '''
+    LRU cache of read-only arrays, bounded by their total size in bytes. Thread-safe.
+    '''
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, filename, load):
+        '''
+        :param key: (artifact, state, subframe), subframe is None for per state files
+        :param filename: file the array is decoded from
+        :param load: function filename -> array, a result of None is returned but not cached
+        :return: the (read-only) array
+        '''
+        try:
+            mtime = os.stat(filename).st_mtime_ns
+        except OSError:
+            mtime = None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == mtime:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        value = load(filename)
+        if value is None or mtime is None or self.max_bytes <= 0:
+            return value
+        # callers get the cached array itself, so it must not be changed in place
+        value.flags.writeable = False
+        with self.lock:
+            self._remove(key)
+            if value.nbytes <= self.max_bytes:
+                self.entries[key] = (mtime, value)
+                self.bytes += value.nbytes
+                self._trim()
+        return value
+
+    def resize(self, max_bytes):
+        '''
+        :param max_bytes: new size limit, 0 disables the cache
+        '''
+        with self.lock:
+            self.max_bytes = max_bytes
+            self._trim()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        '''
+        :return: dict with the hits, misses, number of entries and size in bytes of the cache
+        '''
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries), 'bytes': self.bytes}
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1].nbytes
+
+    def _trim(self):
+        while self.entries and self.bytes > max(self.max_bytes, 0):
+            _, (_, value) = self.entries.popitem(last=False)
+            self.bytes -= value.nbytes
+
+
+FRAME_CACHE = FrameCache()
+
+
+def configure(max_bytes):
+    '''
+    sets the size of the cache of this process, also used as initializer of worker processes
+    '''
+    FRAME_CACHE.resize(max_bytes)
+
+
+def worker_budget(workers):
+    '''
+    :param workers: number of worker processes of a pool, None for one per CPU
+    :return: cache size of each worker, so that all of them together stay within the size of this process's cache
+    '''
+    return FRAME_CACHE.max_bytes // max(workers or os.cpu_count() or 1, 1)
+
+
+def cached_load(artifact, state, subframe, filename, load):
+    '''
+    :param artifact: folder and decoding of the file, e.g. (screen folder, 'rgb')
+    :return: load(filename), from the cache if the file did not change since it was cached
+    '''
+    return FRAME_CACHE.get((artifact, state, subframe), filename, load)
+
+
+def stats():
+    return FRAME_CACHE.stats()
@@ -10,16 +10,82 @@ import pandas as pd
 import os
 import re
 from bisect import bisect
+from bisect import bisect_left
 from bisect import insort_left
 import image_utils
+from state_arrays import read_state_array_file, state_array_filename
+from stream_index import folder_index
 from scipy.spatial import distance
 import coloredlogs, logging
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 def print_df(stats_df):
     print("DF: ")
     with pd.option_context('display.max_rows', None, 'display.max_columns', None):  # more options can be specified also
         print(stats_df)
 
+class BlockedRanges(object):
+    '''
+    Keeps the open intervals around already chosen summary states in which no new state may be chosen.
+    A state t blocks every state s with |s - t| < width, where width is context_length + minimum_gap.
+    Overlapping intervals are merged, so the starts and ends stay sorted and a lookup is a single bisect.
+    '''
+
+    def __init__(self, width):
+        self.width = width
+        self.starts = []
+        self.ends = []
+
+    def is_blocked(self, state):
+        index = bisect(self.starts, state) - 1
+        return index >= 0 and self.starts[index] < state < self.ends[index]
+
+    def block(self, state):
+        if self.width <= 0:
+            return
+        start = state - self.width
+        end = state + self.width
+        first = bisect(self.ends, start)
+        last = bisect_left(self.starts, end)
+        if first < last:
+            start = min(start, self.starts[first])
+            end = max(end, self.ends[last - 1])
+        self.starts[first:last] = [start]
+        self.ends[first:last] = [end]
+
+
+def greedy_state_selection(candidate_states, budget, context_length, minimum_gap):
+    ''' goes through the candidates in the given order and takes every state that is far enough away from the states
+    that were already taken, until the budget is reached
+    :param candidate_states: sequence of state indices in the order in which they should be considered
+    :param budget: see highlights
+    :param context_length: see highlights
+    :param minimum_gap: see highlights
+    :return: sorted list of the chosen states
+    '''
+    summary_states = []
+    blocked = BlockedRanges(context_length + minimum_gap)
+    for state_index in candidate_states:
+        if blocked.is_blocked(state_index):
+            continue
+        insort_left(summary_states, state_index)
+        blocked.block(state_index)
+        if len(summary_states) == budget:
+            break
+    return summary_states
+
+
+def shuffled_state_positions(num_states, seed=None):
+    ''' draws the random order used by random_state_selection. This is the same draw that
+    DataFrame.sample(frac=1.0, replace=True, random_state=seed) makes, so summaries stay the same for a given seed.
+    :param num_states: number of states to draw from
+    :param seed: optional int to set a seed, if None numpy's global random state is used
+    :return: array with num_states positions (with repetitions)
+    '''
+    random_state = np.random if seed is None else np.random.RandomState(seed)
+    return random_state.choice(num_states, size=num_states, replace=True)
+
+
 def random_state_selection(state_importance_df, budget, context_length, minimum_gap, seed = None):
     ''' generate random summary
     :param state_importance_df: dataframe with 2 columns: state and importance score of the state
@@ -33,41 +99,42 @@ def random_state_selection(state_importance_df, budget, context_length, minimum_
     :param seed: optional int to set a seed
     :return: a list with the indices of the randomly chosen states, and a list with all summary states (includes the context)
     '''
-    shuffled_states = state_importance_df.sample(frac=1.0, random_state=seed, replace=True)
-    summary_states = []
-    for index, row in shuffled_states.iterrows():
-
-        state_index = row['state']
-        index_in_summary = bisect(summary_states, state_index)
-        # print('state: ', state_index)
-        # print('index in summary: ', index_in_summary)
-        # print('summary: ', summary_states)
-        state_before = None
-        state_after = None
-        if index_in_summary > 0:
-            state_before = summary_states[index_in_summary-1]
-        if index_in_summary < len(summary_states):
-            state_after = summary_states[index_in_summary]
-        if state_after is not None:
-            if state_index+context_length+minimum_gap > state_after:
-                continue
-        if state_before is not None:
-            if state_index-context_length-minimum_gap < state_before:
-                continue
-        insort_left(summary_states,state_index)
-        if len(summary_states) == budget:
-            break
+    return random_selection_from_states(state_importance_df['state'].values, budget, context_length, minimum_gap, seed)
+
+def random_selection_from_states(states, budget, context_length, minimum_gap, seed = None):
+    ''' random_state_selection on a plain array of state indices
+    :param states: numpy array with the indices of all states that can be chosen
+    :param seed: optional int to set a seed
+    :return: see random_state_selection
+    '''
+    shuffled_states = states[shuffled_state_positions(len(states), seed)].tolist()
+    summary_states = greedy_state_selection(shuffled_states, budget, context_length, minimum_gap)
 
     summary_states_with_context = []
     for state in summary_states:
         min_range = int(state - context_length)
         max_range = int(state + context_length)
         summary_states_with_context.extend((range(min_range,max_range)))
-    ls = [type(item) for item in summary_states_with_context]
-    print("Type of random list before being returned from highlights random state selection is:")
-    print(ls)
     return summary_states, summary_states_with_context
 
+def random_state_selections(state_importance_df, budget, context_length, minimum_gap, seeds):
+    ''' generate one random summary per seed from the same state array
+    :param state_importance_df: dataframe with at least the column state
+    :param seeds: list of seeds, one summary is generated for each of them
+    :return: a list with the chosen states per seed, a list with the summary states (includes the context) per seed
+    and a sorted list of all states that appear in any of the summaries
+    '''
+    states = state_importance_df['state'].values
+    random_states = []
+    random_states_with_context = []
+    for seed in seeds:
+        summary_states, summary_states_with_context = random_selection_from_states(states, budget, context_length,
+                                                                                    minimum_gap, seed)
+        random_states.append(summary_states)
+        random_states_with_context.append(summary_states_with_context)
+    union = sorted(set().union(*random_states_with_context))
+    return random_states, random_states_with_context, union
+
 def highlights(state_importance_df, budget, context_length, minimum_gap):
     ''' generate highlights summary
     :param state_importance_df: dataframe with 2 columns: state and importance score of the state
@@ -86,29 +153,7 @@ def highlights(state_importance_df, budget, context_length, minimum_gap):
     logger.setLevel(logging.DEBUG)
         
     sorted_df = state_importance_df.sort_values(['importance'], ascending=False)
-    summary_states = []
-    for index, row in sorted_df.iterrows():
-
-        state_index = row['state']
-        index_in_summary = bisect(summary_states, state_index)
-        # print('state: ', state_index)
-        # print('index in summary: ', index_in_summary)
-        # print('summary: ', summary_states)
-        state_before = None
-        state_after = None
-        if index_in_summary > 0:
-            state_before = summary_states[index_in_summary-1]
-        if index_in_summary < len(summary_states):
-            state_after = summary_states[index_in_summary]
-        if state_after is not None:
-            if state_index+context_length+minimum_gap > state_after:
-                continue
-        if state_before is not None:
-            if state_index-context_length-minimum_gap < state_before:
-                continue
-        insort_left(summary_states,state_index)
-        if len(summary_states) == budget:
-            break
+    summary_states = greedy_state_selection(sorted_df['state'].values.tolist(), budget, context_length, minimum_gap)
 
     summary_states_with_context = []
     for state in summary_states:
@@ -141,7 +186,71 @@ def find_similar_state_in_summary(state_importance_df, summary_states, new_state
     return None
 
 
-def highlights_div(args, state_importance_df, budget, context_length, minimum_gap, distance_metric=distance.euclidean, percentile_threshold=3, subset_threshold = 10):
+def is_diverse_from_context(context_features, new_features, distance_metric, threshold):
+    ''' decides whether a candidate is different enough from all states already shown in the summary.
+    Gives the same answer as comparing the result of find_similar_state_in_summary to the threshold, but stops at the
+    first state that is too close.
+    :param context_features: feature vectors of all summary states including their context
+    :param new_features: feature vector of the candidate state
+    :param distance_metric: metric to use for comparing states (function)
+    :param threshold: minimal distance to all context states
+    :return: True if the candidate may be added to the summary
+    '''
+    for state_features in context_features:
+        distance = distance_metric(state_features, new_features)
+        if distance < 10000000 and distance <= threshold:
+            return False
+    return True
+
+
+def feature_rows(state_features, rows):
+    ''' materializes the feature vectors of some rows
+    :param state_features: sequence of feature vectors, one per state, or a feature_source.FeatureSource
+    :param rows: the rows
+    :return: sequence with the feature vectors of the rows
+    '''
+    if hasattr(state_features, 'rows'):
+        return state_features.rows(rows)
+    return [state_features[row] for row in rows]
+
+
+def candidate_features(sorted_rows, state_features, is_candidate, block_size):
+    ''' goes through the rows in the given order and materializes the features of the rows that are still candidates,
+    one block at a time, so only block_size feature vectors have to be in memory
+    :param sorted_rows: rows in the order in which they should be considered
+    :param state_features: see feature_rows
+    :param is_candidate: function that gets a row and returns False if it can be skipped
+    :param block_size: number of rows per block
+    :return: generator of (row, feature vector)
+    '''
+    for start in range(0, len(sorted_rows), block_size):
+        block = [row for row in sorted_rows[start:start + block_size] if is_candidate(row)]
+        if block:
+            for row, features in zip(block, feature_rows(state_features, block)):
+                yield row, features
+
+
+def compute_div_threshold(state_features, distance_metric=distance.euclidean, percentile_threshold=3, subset_threshold=10):
+    ''' estimates the minimal distance between summary states from the pairwise distances of a random subset of states
+    :param state_features: sequence of feature vectors, one per state, or a feature_source.FeatureSource
+    :param distance_metric: metric to use for comparing states (function)
+    :param percentile_threshold: percentile of the pairwise distances that is used as threshold
+    :param subset_threshold: number of random states to be used as basis for the div-threshold
+    :return: the threshold
+    '''
+    # changed replace from True to False Dec. 4
+    subset = np.random.choice(len(state_features), size=subset_threshold, replace=False)
+    subset_features = feature_rows(state_features, subset)
+    distances = []
+    for i in range(len(subset)):
+        for j in range(i+1,len(subset)):
+            distance = distance_metric(subset_features[i],subset_features[j])
+            distances.append(distance)
+    distances = np.array(distances)
+    return np.percentile(distances,percentile_threshold)
+
+
+def highlights_div(args, state_importance_df, budget, context_length, minimum_gap, distance_metric=distance.euclidean, percentile_threshold=3, subset_threshold = 10, feature_source=None, block_size=1024, threshold=None, sorted_states=None):
     ''' generate highlights-div  summary
     :param state_importance_df: dataframe with 2 columns: state and importance score of the state
     :param budget: allowed length of summary - note this includes only the important states, it doesn't count context
@@ -154,6 +263,12 @@ def highlights_div(args, state_importance_df, budget, context_length, minimum_ga
     :param distance_metric: metric to use for comparing states (function)
     :param percentile_threshold: what minimal distance to allow between states in summary
     :param subset_threshold: number of random states to be used as basis for the div-threshold
+    :param feature_source: optional feature_source.FeatureSource with the features of all states, used instead of the
+    features column so that only block_size feature vectors are materialized at a time
+    :param block_size: number of candidates whose features are materialized at once
+    :param threshold: optional precomputed div-threshold (see compute_div_threshold), e.g. from a cache
+    :param sorted_states: optional states sorted by decreasing importance (see merge_importance_order), used instead of
+    sorting the dataframe
     :return: a list with the indices of the important states, and a list with all summary states (includes the context)
     '''
     
@@ -174,110 +289,93 @@ def highlights_div(args, state_importance_df, budget, context_length, minimum_ga
             logger.info("state_features_importance_df")
             logger.info(state_importance_df)
             logger.info("In highlights DIV")
-#    state_importance_df.index.name = 'state'
-#    with pd.option_context('display.max_rows', None, 'display.max_columns', None):  # more options can be specified also
-#        print(state_importance_df)
-    min_state = state_importance_df['state'].values.min()
-    max_state = state_importance_df['state'].values.max()
-
-    state_features = state_importance_df['features'].values
-    # changed replace from True to False Dec. 4
-    state_features = np.random.choice(state_features, size=subset_threshold, replace=False)
-    distances = []
-    for i in range(len(state_features-1)):
-        for j in range(i+1,len(state_features)):
-            distance = distance_metric(state_features[i],state_features[j])
-            distances.append(distance)
-    distances = np.array(distances)
-    threshold = np.percentile(distances,percentile_threshold)
+    states = state_importance_df['state'].values.tolist()
+    min_state = min(states)
+    max_state = max(states)
+
+    if feature_source is None:
+        state_features = state_importance_df['features'].values
+    else:
+        state_features = feature_source.subset(states)
+    if threshold is None:
+        threshold = compute_div_threshold(state_features, distance_metric, percentile_threshold, subset_threshold)
     if (args.verbose):
         print('threshold:',threshold)
         logger.info("About to call state_importance Sort_values")
-    
-    # Sorts by importance, then goes down the df
-    # for each row, it finds where the state would fall in the summary list
-    # Checks if the new state has enough distance between the state before and after
-    # Checks if a state in the summary is already similar
-    # If not, puts into list
-    sorted_df = state_importance_df.sort_values(['importance'], ascending=False)
+
+    # row of every state in state_features, replaces the per-state lookups in the dataframe
+    state_rows = {state: row for row, state in enumerate(states)}
+
+    # Sorts by importance, then goes down the states
+    # for each state, it checks if there is enough distance to the states already in the summary
+    # Checks if a state in the summary (or its context) is already similar
+    # If not, puts into list and adds its context to the states we compare against
+    if sorted_states is None:
+        sorted_rows = state_importance_df[['importance']].reset_index(drop=True).sort_values(['importance'], ascending=False).index.values
+    else:
+        sorted_rows = np.array([state_rows[state] for state in np.asarray(sorted_states).tolist() if state in state_rows], dtype=int)
     summary_states = []
-    summary_states_with_context = []
-    num_chosen_states = 0
-    for index, row in sorted_df.iterrows():
-        if (args.verbose):
-            logger.info("Iterating through df of sorted state features")
-        state_index = row['state']
-        index_in_summary = bisect(summary_states, state_index)
-        if (args.verbose):
-             print('state: ', state_index)
-             print('index in summary: ', index_in_summary)
-             print('summary: ', summary_states)
-        state_before = None
-        state_after = None
-        if index_in_summary > 0:
-            state_before = summary_states[index_in_summary-1]
-        if index_in_summary < len(summary_states):
-            state_after = summary_states[index_in_summary]
-        if state_after is not None:
-            if state_index+context_length+minimum_gap > state_after:
-                continue
-        if state_before is not None:
-            if state_index-context_length-minimum_gap < state_before:
-                continue
-
-        # if num_chosen_states < budget:
-        #     insort_left(summary_states,state_index)
-        #     num_chosen_states += 1
-
-
-        # compare to most similar state
-        if (args.verbose):
-            logger.info("About to call find_similar_state_in_summary")
-        most_similar_state, min_distance = find_similar_state_in_summary(state_importance_df, summary_states_with_context, row['features'], distance_metric)
-        if most_similar_state is None:
+    blocked = BlockedRanges(context_length + minimum_gap)
+    context_states = set()
+    context_features = []
+    is_candidate = lambda row: not blocked.is_blocked(states[row])
+    for row, features in candidate_features(sorted_rows.tolist(), state_features, is_candidate, block_size):
+        state_index = states[row]
+        if blocked.is_blocked(state_index):
+            continue
+
+        if is_diverse_from_context(context_features, features, distance_metric, threshold):
             insort_left(summary_states,state_index)
-            num_chosen_states += 1
+            blocked.block(state_index)
+            # Removed coercion toInt on Dec 4
+            left_index = max(int(state_index) - int(context_length),min_state)
+            right_index = min(int(state_index) + int(context_length),max_state) +1
+            new_context_states = [state for state in range(left_index, right_index) if state not in context_states]
+            context_states.update(new_context_states)
+            context_features.extend(feature_rows(state_features, [state_rows[state] for state in new_context_states]))
             if (args.verbose):
                 print('summary_states:', summary_states)
-
+                print('took')
         else:
-            # similar_state_importance = state_importance_df.loc[state_importance_df['state'] == most_similar_state].iloc[0].importance
-            # if row['importance'] > similar_state_importance:
-            if min_distance > threshold:
-                insort_left(summary_states,state_index)
-                num_chosen_states += 1
-                if (args.verbose):
-                    print('summary_states:', summary_states)
-                    print('took')
-            else:
-                if (args.verbose):
-                    print(state_index)
-                    print('skipped')
-
-        #recalculate the context states
-        summary_states_with_context = []
-        for state in summary_states:
             if (args.verbose):
-                logger.info("Iterating through summary states")
-            # Removed coercion toInt on Dec 4
-            left_index = max(int(state) - int(context_length),min_state)
-            right_index = min(int(state) + int(context_length),max_state) +1
-            summary_states_with_context.extend((range(left_index, right_index)))
+                print(state_index)
+                print('skipped')
 
         # Indented by one on Dec. 4
         if len(summary_states) == budget:
                 logger.info("Hit budget limit")
                 break
+
+    summary_states_with_context = []
+    for state in summary_states:
+        left_index = max(int(state) - int(context_length),min_state)
+        right_index = min(int(state) + int(context_length),max_state) +1
+        summary_states_with_context.extend((range(left_index, right_index)))
     if (args.verbose):
         logger.info("Returning from div highlights")
         logger.info("ONLY Summary states in highlights div are: ")
         logger.info(summary_states)
         logger.info("zsummary states in highlights div with context are: ")
         logger.info(summary_states_with_context)
-        logger.info(list(summary_states_with_context))
     return summary_states, list(summary_states_with_context)
 
 
+def merge_importance_order(sorted_states, sorted_importance, new_states, new_importance):
+    ''' inserts new states into states that are already sorted by decreasing importance, so a grown stream does not have
+    to be sorted again. On ties the states that were already sorted come first.
+    :param sorted_states: states sorted by decreasing importance
+    :param sorted_importance: their importance
+    :param new_states: states to insert (in any order)
+    :param new_importance: their importance
+    :return: merged states and importance, sorted by decreasing importance
+    '''
+    new_order = np.argsort(-np.asarray(new_importance), kind='stable')
+    new_states = np.asarray(new_states)[new_order]
+    new_importance = np.asarray(new_importance)[new_order]
+    positions = np.searchsorted(-np.asarray(sorted_importance), -new_importance, side='right')
+    return np.insert(sorted_states, positions, new_states), np.insert(sorted_importance, positions, new_importance)
+
+
 def compute_states_importance(args, states_q_values_df, compare_to='worst'):
     print("In compute state import and states are: ")
     print(states_q_values_df['state'])
@@ -303,72 +401,124 @@ def compute_states_importance(args, states_q_values_df, compare_to='worst'):
     
     return states_q_values_df
 
-def read_q_value_files(path):
-    ''' reading q values from files. Assume each state is a seperate text file with a list of q values
+def state_index_from_filename(filename):
+    ''' extracts the state index from file names like q_values_123.txt or state_123.npy '''
+    file_split = filename.split('_')
+    return int(re.search(r'\d+', file_split[len(file_split)-1][:-4]).group())
+
+def list_state_files(path, extension=None):
+    ''' lists the per state files of a stream directory
+    :param path: path to the directory where the files are stored
+    :param extension: only use files with this extension, if None all files are used
+    :return: list of (state index, file path) tuples sorted by state index
+    '''
+    index = folder_index(path)
+    return [(state, index.path(filename)) for state, _, filename in index.frames()
+            if extension is None or filename.endswith(extension)]
+
+def parse_array_text(text):
+    ''' parses an array that was saved as str(array) '''
+    text = str.strip(text, '[]')
+    text = text.replace('\n', ' ').replace('[', ' ').replace(']', ' ')
+    return np.fromstring(text, dtype=float, sep=' ')
+
+def load_text_array(filename):
+    with open(filename, 'r') as array_file:
+        return parse_array_text(array_file.read())
+
+def load_flat_array(filename):
+    # flatten arrays since we only need the distance between states
+    return np.load(filename).flatten()
+
+def read_state_arrays(path, extension, load_file, workers=None, use_processes=False):
+    ''' reads one array per state from a directory in parallel
+    :param path: path to the directory where the files are stored
+    :param extension: only use files with this extension, if None all files are used
+    :param load_file: function that loads the array from a file path (must be a module level function when
+    use_processes is True)
+    :param workers: number of threads or processes, None uses the executor's default
+    :param use_processes: use a process pool instead of a thread pool, for when parsing and not I/O is the bottleneck
+    :return: array with the state indices (sorted) and a list with one array per state in the same order
+    '''
+    state_files = list_state_files(path, extension)
+    states = np.array([state for state, _ in state_files], dtype=int)
+    filenames = [filename for _, filename in state_files]
+    if use_processes:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        chunksize = max(1, len(filenames) // (4 * (workers or os.cpu_count() or 1)))
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+        chunksize = 1
+    with executor:
+        arrays = list(executor.map(load_file, filenames, chunksize=chunksize))
+    return states, arrays
+
+def read_state_matrix(path, extension, load_file, workers=None, use_processes=False):
+    ''' like read_state_arrays, but returns the arrays as one contiguous (number of states, array length) matrix
+    :return: array with the state indices (sorted) and the matrix, row i belongs to states[i]
+    '''
+    states, arrays = read_state_arrays(path, extension, load_file, workers, use_processes)
+    if len(arrays) == 0:
+        return states, np.zeros((0, 0))
+    return states, np.stack(arrays)
+
+def read_state_array_rows(filename):
+    ''' reads a consolidated state array file with one read
+    :param filename: path of the file
+    :return: array with the state indices (sorted) and a list with one array per state in the same order
+    '''
+    states, values = read_state_array_file(filename)
+    order = np.argsort(states, kind='stable')
+    return states[order], list(values[order])
+
+def read_q_value_files(path, workers=None, use_processes=False):
+    ''' reading q values from files. Uses the consolidated file path + '.bin' if it exists (see state_arrays),
+    otherwise assumes each state is a seperate text file with a list of q values
     :param path: path to the directory where the text files are stored
-    :return: a pandas dataframe with two columns: state (index) and q_values (numpy array)
+    :param workers: see read_state_arrays
+    :param use_processes: see read_state_arrays
+    :return: a pandas dataframe with two columns: state (index) and q_values (numpy array), sorted by state
     '''
     logger = logging.getLogger()
     coloredlogs.install(level='DEBUG', fmt='%(asctime)s,%(msecs)03d %(filename)s[%(process)d] %(levelname)s %(message)s')
     
     logger.setLevel(logging.DEBUG)
     
-    states = []
-    q_values_list = []
-    for filename in os.listdir(path):
-        file_split = filename.split('_')
-        print("file split is: " + str(file_split))
-        state_index_temp = file_split[len(file_split)-1][:-4]
-        state_index = re.search(r'\d+', state_index_temp).group()
-        print("State index is: " + str(state_index))
-        
-        states.append(state_index)
-        # print(filename)
-        with open(path+'/'+filename, 'r') as q_val_file:
-            q_vals = str.strip(q_val_file.read(),'[]')
-            q_vals = np.fromstring(q_vals,dtype=float, sep=' ')
-            q_values_list.append(q_vals)
-
+    if os.path.exists(state_array_filename(path)):
+        states, q_values_list = read_state_array_rows(state_array_filename(path))
+    else:
+        states, q_values_list = read_state_arrays(path, None, load_text_array, workers, use_processes)
     q_values_df = pd.DataFrame({'state':states, 'q_values':q_values_list})
-    print("HighlightsSelect and q_values_df is: ")
-    print_df(q_values_df)
     return q_values_df
 
-def read_feature_files(path):
-    ''' reading state features from files. Assume each state is a seperate text file with a feature vector
+def read_feature_files(path, workers=None, use_processes=False):
+    ''' reading state features from files. Uses the consolidated file path + '.bin' if it exists (see state_arrays),
+    otherwise assumes each state is a seperate text file with a feature vector
     :param path: path to the directory where the text files are stored
-    :return: a pandas dataframe with two columns: state (index) and features (numpy array)
+    :param workers: see read_state_arrays
+    :param use_processes: see read_state_arrays
+    :return: a pandas dataframe with two columns: state (index) and features (numpy array), sorted by state
     '''
     logger = logging.getLogger()
     coloredlogs.install(level='DEBUG', fmt='%(asctime)s,%(msecs)03d %(filename)s[%(process)d] %(levelname)s %(message)s')
     
     logger.setLevel(logging.DEBUG)
     
-    states = []
-    feature_vector_list = []
-    for filename in os.listdir(path):
-        if not filename.endswith('.txt'):  # skip text files, use npy files
-            continue
-        file_split = filename.split('_')
-        state_index = int(file_split[len(file_split)-1][:-4])
-        states.append(state_index)
-        # print(filename)
-        with open(path+'/'+filename, 'r') as feature_file:
-            features_text = str.strip(feature_file.read(),'[]')
-            features_text = features_text.replace('\n', ' ')
-            features_text = ' '.join(features_text.split())
-            feature_vector = np.fromstring(features_text, dtype=float, sep=' ')
-            feature_vector_list.append(feature_vector)
-
+    if os.path.exists(state_array_filename(path)):
+        states, feature_vector_list = read_state_array_rows(state_array_filename(path))
+    else:
+        states, feature_vector_list = read_state_arrays(path, '.txt', load_text_array, workers, use_processes)
     state_features_df = pd.DataFrame({'state':states, 'features':feature_vector_list})
 #    print("HighlightsSelect and state_features_df is: ")
 #    print_df(state_features_df)
     return state_features_df
 
-def read_input_files(path):
+def read_input_files(path, workers=None, use_processes=False):
     '''reading state inputs from files. Assume each state is a seperate npy file with a array
     :param path: path to the directory where the npy files are stored
-    :return: a pandas dataframe with two columns: state (index) and features (numpy array)
+    :param workers: see read_state_arrays
+    :param use_processes: see read_state_arrays
+    :return: a pandas dataframe with two columns: state (index) and features (numpy array), sorted by state
     The inputs are called features so one can use the df interchangeably with the one from read_feature_files.
     '''
     logger = logging.getLogger()
@@ -376,18 +526,7 @@ def read_input_files(path):
     
     logger.setLevel(logging.DEBUG)
     
-    states = []
-    input_list = []
-    for filename in os.listdir(path):
-        if filename.endswith('.npy'):  # only use npy files
-            file_split = filename.split('_')
-            state_index = int(file_split[len(file_split) - 1][:-4])
-            states.append(state_index)
-
-            input = np.load(os.path.join(path,filename))
-            input = input.flatten() #flatten arrays since we only need the distance between states
-            input_list.append(input)
-
+    states, input_list = read_state_arrays(path, '.npy', load_flat_array, workers, use_processes)
     state_input_df = pd.DataFrame({'state': states, 'features': input_list}) #we use features as name to make the div-code less bloated
 #    print("HighlightsSelect and state_input_df is: ")
 #    print_df(state_input_df)
@@ -16,7 +16,14 @@ import sys
 import cv2
 import os
 import re
+import shutil
+import subprocess
 import scipy
+import functools
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from stream_index import folder_index
+import frame_cache
 
 def add_saliency_to_image(saliency, image, saliency_brightness = 2):
     '''
@@ -28,14 +35,11 @@ def add_saliency_to_image(saliency, image, saliency_brightness = 2):
     '''
     
     image_shape = (image.shape[0],image.shape[1])
-    saliency = transform.resize(saliency, image_shape, order=0, mode='reflect')
-    
-    zeros = np.zeros(image_shape)
-    saliency = np.stack((zeros, saliency, zeros), axis=-1)
-    saliency *= saliency_brightness
+    saliency = float_image(resize_nearest(saliency, image_shape))
 
-    final_image = image + saliency
-    final_image = np.clip(final_image, 0, 1)
+    final_image = float_image(image, copy=True)
+    final_image[:, :, 1] += saliency * saliency_brightness
+    np.clip(final_image, 0, 1, out=final_image)
     
     return final_image
     
@@ -51,8 +55,7 @@ def add_blur_saliency_to_image(saliency, image, saliency_brightness = .9):
 
     image_shape = (image.shape[0],image.shape[1])
     
-    saliency = transform.resize(saliency, image_shape, order=0, mode='reflect')
-    saliency *= saliency_brightness
+    saliency = float_image(resize_nearest(saliency, image_shape)) * saliency_brightness
 #    print("Blur mask: ")
 #    print(saliency)
     final_image, edges = simple_non_uniform_blur(image, saliency)
@@ -61,26 +64,123 @@ def add_blur_saliency_to_image(saliency, image, saliency_brightness = .9):
     final_image = np.clip(final_image, 0, 1)
     return final_image
     
+def float_image(image, copy=False):
+    '''
+    :param image: image as integer or float array
+    :param copy: if False a float32 image is returned as it is
+    :return: the image as float32, integer images are scaled to [0, 1] (like skimage.img_as_float)
+    '''
+    image = np.asarray(image)
+    if np.issubdtype(image.dtype, np.integer):
+        return image.astype(np.float32) / np.iinfo(image.dtype).max
+    return image.astype(np.float32, copy=copy)
+
+@functools.lru_cache(maxsize=None)
+def nearest_indices(size, new_size):
+    '''
+    :return: the source index of every output index when scaling an axis from size to new_size with nearest neighbour
+    interpolation, the same as transform.resize(order=0) when upscaling
+    '''
+    indices = np.minimum(np.floor((np.arange(new_size) + 0.5) * size / new_size).astype(np.intp), size - 1)
+    indices.flags.writeable = False
+    return indices
+
+def resize_nearest(image, output_shape, out=None, axis=0):
+    '''
+    nearest neighbour upscaling that keeps the dtype, replaces transform.resize(image, output_shape, order=0,
+    mode='reflect'). Integer factors are repeated with cv2.resize or a broadcasted copy, other factors use
+    precomputed indices. Downscaling falls back to skimage, which anti-aliases.
+    :param image: image, or stack of images if axis is 1
+    :param output_shape: (height, width) of the result
+    :param out: optional preallocated result
+    :param axis: axis of the height, the width is the next axis
+    :return: the resized image
+    '''
+    image = np.asarray(image)
+    height, width = image.shape[axis], image.shape[axis + 1]
+    new_height, new_width = output_shape[0], output_shape[1]
+    if len(output_shape) > 2 or new_height < height or new_width < width:
+        if axis == 0:
+            return transform.resize(image, output_shape, order=0, mode='reflect')
+        return np.stack([resize_nearest(part, output_shape, axis=axis - 1) for part in image])
+    if out is None:
+        out = np.empty(image.shape[:axis] + (new_height, new_width) + image.shape[axis + 2:], dtype=image.dtype)
+    if new_height % height == 0 and new_width % width == 0:
+        if axis == 0 and image.dtype in (np.uint8, np.float32, np.float64) and (image.ndim == 2 or (image.ndim == 3 and image.shape[2] in (3, 4))):
+            cv2.resize(image, (new_width, new_height), dst=out, interpolation=cv2.INTER_NEAREST)
+        else:
+            blocks = out.reshape(image.shape[:axis] + (height, new_height // height, width, new_width // width) + image.shape[axis + 2:])
+            blocks[...] = np.expand_dims(np.expand_dims(image, axis + 1), axis + 3)
+    else:
+        rows = np.take(image, nearest_indices(height, new_height), axis=axis)
+        np.take(rows, nearest_indices(width, new_width), axis=axis + 1, out=out)
+    return out
+
+def gaussian_blur(image, sigma):
+    '''
+    cv2 version of scipy.ndimage.gaussian_filter(image, [sigma, sigma, 0]), with the same kernel size (truncate=4)
+    and border mode (reflect). Channels are blurred independently.
+    '''
+    ksize = 2 * int(4 * sigma + 0.5) + 1
+    return cv2.GaussianBlur(image, (ksize, ksize), sigma, borderType=cv2.BORDER_REFLECT)
+
+def percentile_level(values, percentile):
+    '''
+    :param values: array, or (N, ...) stack of arrays
+    :param percentile: position in the sorted values as fraction
+    :return: the value at position int(percentile * size) of the sorted values (per array of the stack), found with
+    np.partition instead of sorting
+    '''
+    flat = values.reshape(-1) if values.ndim <= 2 else values.reshape(values.shape[0], -1)
+    k = int(percentile * flat.shape[-1])
+    return np.partition(flat, k, axis=-1)[..., k]
+
+def mask_edges(mask, sigma=3):
+    '''
+    cv2 version of skimage.feature.canny(mask, sigma) for boolean masks
+    '''
+    ksize = 2 * int(4 * sigma + 0.5) + 1
+    smoothed = cv2.GaussianBlur(mask.astype(np.float32), (ksize, ksize), sigma, borderType=cv2.BORDER_CONSTANT)
+    smoothed = np.rint(smoothed * 255).astype(np.uint8)
+    return cv2.Canny(smoothed, 0.1 * 255, 0.2 * 255, L2gradient=True) > 0
+
 def simple_non_uniform_blur(img, sal, percentile=.85, sigma_img=5, sigma_sal=10):
 
 # percentile: how tight of circles to draw around saliency
 # sigma_img: how blurry to make the blurred parts
 # sigma_sal: how much to combine nearby regions into one
 
-    sal_blurred = scipy.ndimage.filters.gaussian_filter(sal, sigma_sal)
-    img_blurred = scipy.ndimage.filters.gaussian_filter(img, [sigma_img, sigma_img, 0])
-    levels = sorted(sal_blurred.flat)
-    mask = sal_blurred > levels[int(percentile*len(levels))]
+    img = float_image(img)
+    sal_blurred = gaussian_blur(float_image(sal), sigma_sal)
+    img_blurred = gaussian_blur(img, sigma_img)
+    mask = sal_blurred > percentile_level(sal_blurred, percentile)
     
     # try to add white line to edge here
-    edged_mask = skimage.feature.canny(mask, sigma = 3)
-    
-#    final_array = np.moveaxis(np.array([mask*img[:, :, i] + (~mask)*img_blurred[:, :, i] for i in range(3)]),[1, 2, 0], [0, 1, 2])
+    edged_mask = mask_edges(mask, sigma = 3)
 
-    final_array = np.moveaxis(np.array([mask*img[:, :, i] + (~mask)*img_blurred[:, :, i] for i in range(3)]),[1, 2, 0], [0, 1, 2])
+    final_array = np.where(mask[:, :, np.newaxis], img, img_blurred)
     
     return final_array, edged_mask
 
+def simple_non_uniform_blur_batch(imgs, sals, percentile=.85, sigma_img=5, sigma_sal=10):
+    '''
+    simple_non_uniform_blur for a stack of frames
+    :param imgs: (N, H, W, 3) images
+    :param sals: (N, H, W) saliency maps
+    :return: (N, H, W, 3) blurred images and (N, H, W) edge masks
+    '''
+    imgs = float_image(imgs)
+    sals = float_image(sals)
+    sal_blurred = np.empty_like(sals)
+    img_blurred = np.empty_like(imgs)
+    for n in range(len(imgs)):
+        sal_blurred[n] = gaussian_blur(sals[n], sigma_sal)
+        img_blurred[n] = gaussian_blur(imgs[n], sigma_img)
+    masks = sal_blurred > percentile_level(sal_blurred, percentile)[:, np.newaxis, np.newaxis]
+    edged_masks = np.stack([mask_edges(mask, sigma = 3) for mask in masks])
+    final_array = np.where(masks[..., np.newaxis], imgs, img_blurred)
+    return final_array, edged_masks
+
 def create_edge_image(image):
     ''' creates a edge version of an image
     :param image: the original image
@@ -102,7 +202,7 @@ def output_saliency_map(saliency, image, scale_factor = 3, saliency_factor = 10,
     '''
     image = np.squeeze(image)
     output_shape = (image.shape[0] * scale_factor, image.shape[1] * scale_factor)
-    image = transform.resize(image, output_shape, order=0, mode='reflect')
+    image = float_image(resize_nearest(image, output_shape))
     if edges:
         image = create_edge_image(image, output_shape)
 
@@ -122,7 +222,7 @@ def output_blur_saliency_map(saliency, image, scale_factor = 3, saliency_factor
     
     image = np.squeeze(image)
     output_shape = (image.shape[0] * scale_factor, image.shape[1] * scale_factor)
-    image = transform.resize(image, output_shape, order=0, mode='reflect')
+    image = float_image(resize_nearest(image, output_shape))
     
     if edges:
         image = create_edge_image(image, output_shape)
@@ -131,6 +231,128 @@ def output_blur_saliency_map(saliency, image, scale_factor = 3, saliency_factor
 
     return final_image
 
+def add_blur_saliency_to_images(saliencies, images, saliency_brightness = .9):
+    '''
+    add_blur_saliency_to_image for a stack of frames
+    :param saliencies: (N, h, w) saliency maps
+    :param images: (N, H, W, 3) images
+    :return: (N, H, W, 3) overlayed images
+    '''
+    image_shape = (images.shape[1], images.shape[2])
+    saliencies = float_image(resize_nearest(saliencies, image_shape, axis=1)) * saliency_brightness
+    final_images, edges = simple_non_uniform_blur_batch(images, saliencies)
+    final_images[edges] = 1
+    return np.clip(final_images, 0, 1, out=final_images)
+
+def output_blur_saliency_map_batch(saliencies, images, scale_factor = 3, saliency_factor = 2):
+    '''
+    output_blur_saliency_map (without edges) for a stack of frames
+    :param saliencies: (N, h, w) saliency maps
+    :param images: (N, H, W, 3) images
+    :param scale_factor: factor to scale height and width of the images
+    :return: (N, H * scale_factor, W * scale_factor, 3) overlayed images
+    '''
+    images = resize_nearest(images, (images.shape[1] * scale_factor, images.shape[2] * scale_factor), axis=1)
+    return add_blur_saliency_to_images(saliencies, images, saliency_factor)
+
+#overlay styles by name, every style maps a (N, H, W, 3) uint8 frame stack and a (N, h, w) saliency stack to the
+#(N, H * scale_factor, W * scale_factor, 3) uint8 overlay stack
+OVERLAY_STYLES = {}
+
+def overlay_style(name):
+    '''
+    decorator that registers a function as overlay style
+    '''
+    def register(style):
+        OVERLAY_STYLES[name] = style
+        return style
+    return register
+
+def get_overlay_style(name):
+    '''
+    :param name: name of a registered overlay style, e.g. 'green'
+    :return: the style function
+    '''
+    if name not in OVERLAY_STYLES:
+        raise ValueError('unknown overlay style ' + str(name) + ', known styles are ' + str(sorted(OVERLAY_STYLES)))
+    return OVERLAY_STYLES[name]
+
+def to_uint8(image):
+    '''
+    converts float images in [0, 1] to uint8 by truncation, like plt.imsave
+    '''
+    if image.dtype == np.uint8:
+        return image
+    return (image * 255).astype(np.uint8)
+
+def upscale_stack(frames, scale_factor):
+    '''
+    :return: the frames scaled by scale_factor as float32 in [0, 1]
+    '''
+    frames = np.asarray(frames)
+    return float_image(resize_nearest(frames, (frames.shape[1] * scale_factor, frames.shape[2] * scale_factor), axis=1))
+
+def add_green_saliency_to_stack(saliencies, images, saliency_brightness):
+    '''
+    add_saliency_to_image for a float32 stack, in place
+    '''
+    saliencies = float_image(resize_nearest(saliencies, images.shape[1:3], axis=1))
+    images[..., 1] += saliencies * saliency_brightness
+    return np.clip(images, 0, 1, out=images)
+
+def edge_stack(images):
+    '''
+    create_edge_image for a float stack: the sobel magnitude of the gray images (skimage.color.rgb2gray and
+    skimage.filters.sobel with reflected borders) in all three channels
+    '''
+    gray = images[..., 0] * 0.2125 + images[..., 1] * 0.7154 + images[..., 2] * 0.0721
+    g = np.pad(gray, ((0, 0), (1, 1), (1, 1)), mode='symmetric')
+    horizontal = (g[:, :-2, :-2] + 2 * g[:, :-2, 1:-1] + g[:, :-2, 2:] - g[:, 2:, :-2] - 2 * g[:, 2:, 1:-1] - g[:, 2:, 2:]) / 4
+    vertical = (g[:, :-2, :-2] + 2 * g[:, 1:-1, :-2] + g[:, 2:, :-2] - g[:, :-2, 2:] - 2 * g[:, 1:-1, 2:] - g[:, 2:, 2:]) / 4
+    edges = np.sqrt((horizontal * horizontal + vertical * vertical) / 2)
+    return np.repeat(edges[..., np.newaxis], 3, axis=-1)
+
+@functools.lru_cache(maxsize=None)
+def green_saliency_lut(saliency_brightness):
+    '''
+    lookup table for overlaying uint8 saliency maps (value / 255) in the green channel of uint8 frames, computed with the
+    same float32 operations as add_green_saliency_to_stack
+    :return: flat table, index pixel * 256 + saliency -> green pixel
+    '''
+    values = np.arange(256, dtype=np.float32) / 255
+    return to_uint8(np.clip(values[:, np.newaxis] + values[np.newaxis, :] * saliency_brightness, 0, 1)).ravel()
+
+@overlay_style('green')
+def green_style(frames, saliencies, scale_factor = 3, saliency_brightness = 10):
+    '''
+    batched output_saliency_map(edges=False): the saliency in the green channel of the frames.
+    uint8 saliency maps (see saliency_source) are applied with a lookup table, without converting the frames to float
+    (the red and blue channels are unchanged by the float round trip).
+    '''
+    if saliencies.dtype != np.uint8:
+        return to_uint8(add_green_saliency_to_stack(saliencies, upscale_stack(frames, scale_factor), saliency_brightness))
+    frames = np.asarray(frames)
+    overlays = resize_nearest(frames, (frames.shape[1] * scale_factor, frames.shape[2] * scale_factor), axis=1)
+    saliencies = resize_nearest(saliencies, overlays.shape[1:3], axis=1)
+    lut_index = (overlays[..., 1].astype(np.uint16) << 8) | saliencies
+    overlays[..., 1] = np.take(green_saliency_lut(saliency_brightness), lut_index)
+    return overlays
+
+@overlay_style('blur')
+def blur_style(frames, saliencies, scale_factor = 3, saliency_brightness = 2):
+    '''
+    batched output_blur_saliency_map(edges=False): the frames blurred outside of the salient regions
+    '''
+    return to_uint8(output_blur_saliency_map_batch(saliencies, np.asarray(frames), scale_factor, saliency_brightness))
+
+@overlay_style('edge')
+def edge_style(frames, saliencies, scale_factor = 3, saliency_brightness = 10):
+    '''
+    batched output_saliency_map(edges=True): the saliency in the green channel of edge versions of the frames
+    '''
+    images = edge_stack(upscale_stack(frames, scale_factor))
+    return to_uint8(add_green_saliency_to_stack(saliencies, images, saliency_brightness))
+
 def saliency_in_channel(saliency, image, scale_factor = 3, saliency_brightness = 2, channel = 1):
     '''
     Ressizes image and adds saliency
@@ -142,11 +364,10 @@ def saliency_in_channel(saliency, image, scale_factor = 3, saliency_brightness =
     '''
     image = np.squeeze(image)
     output_shape = (image.shape[0] * scale_factor, image.shape[1] * scale_factor)
-    image = transform.resize(image, output_shape, order=0, mode='reflect')
-    saliency = transform.resize(saliency, output_shape, order=0, mode='reflect')
-    saliency = saliency * saliency_brightness
-    image[:,:,channel] = saliency
-    image = np.clip(image, 0, 1)
+    image = float_image(resize_nearest(image, output_shape), copy=True)
+    saliency = float_image(resize_nearest(saliency, output_shape))
+    image[:,:,channel] = saliency * saliency_brightness
+    np.clip(image, 0, 1, out=image)
 
     return image
 
@@ -216,12 +437,176 @@ def interpolate(array1, array2, t):
     int_array = float_array.astype('uint8')
     return int_array
 
+def frame_to_uint8(image):
+    '''
+    converts a rendered RGB frame into the uint8 BGR frame cv2.imread returns after it was saved with plt.imsave
+    :param image: uint8 or float RGB image in [0, 1]
+    :return: uint8 BGR image
+    '''
+    # plt.imsave truncates float images
+    return cv2.cvtColor(to_uint8(image), cv2.COLOR_RGB2BGR)
+
+class FFmpegVideoWriter(object):
+    '''
+    cv2.VideoWriter replacement that pipes raw BGR frames to an ffmpeg process, which encodes them with libx264 (H.264
+    plays in browsers, unlike mp4v). The encoding runs in the ffmpeg process with its own threads.
+    '''
+
+    def __init__(self, filename, fps, frame_size, preset = 'veryfast', crf = 23, threads = 0, ffmpeg = 'ffmpeg'):
+        '''
+        :param frame_size: (width, height) of the frames
+        :param preset: libx264 preset, slower presets give smaller files
+        :param crf: libx264 constant rate factor, lower values give better quality and larger files
+        :param threads: number of encoder threads, 0 lets ffmpeg choose
+        '''
+        self.filename = filename
+        self.frame_shape = (frame_size[1], frame_size[0], 3)
+        command = [ffmpeg, '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', '%dx%d' % frame_size, '-r', str(fps), '-i', '-',
+                   '-an', '-c:v', 'libx264', '-preset', preset, '-crf', str(crf), '-threads', str(threads),
+                   '-pix_fmt', 'yuv420p', '-movflags', '+faststart', filename]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def write(self, frame):
+        if frame.shape != self.frame_shape:
+            raise ValueError('frame of shape ' + str(frame.shape) + ' does not fit a video of shape ' + str(self.frame_shape))
+        if self.process is None:
+            raise RuntimeError('ffmpeg is no longer encoding ' + self.filename)
+        try:
+            self.process.stdin.write(np.ascontiguousarray(frame, dtype=np.uint8).data)
+        except BrokenPipeError:
+            # raises the error of ffmpeg if it failed
+            self.release()
+            raise RuntimeError('ffmpeg exited before all frames of ' + self.filename + ' were written')
+
+    def release(self):
+        if self.process is None:
+            return
+        _, error = self.process.communicate()
+        returncode = self.process.returncode
+        self.process = None
+        if returncode != 0:
+            raise IOError('ffmpeg failed to encode ' + self.filename + ': ' + error.decode(errors='replace').strip())
+
+def open_video_encoder(filename, fps, frame_size, encoder = 'auto', preset = 'veryfast', crf = 23, threads = 0):
+    '''
+    :param encoder: 'ffmpeg' for FFmpegVideoWriter, 'cv2' for cv2.VideoWriter with mp4v, 'auto' uses ffmpeg if it is
+    installed. cv2 is used as fallback if ffmpeg is missing.
+    :return: video writer with write(frame) and release()
+    '''
+    if encoder != 'cv2':
+        ffmpeg = shutil.which('ffmpeg')
+        if ffmpeg is not None:
+            return FFmpegVideoWriter(filename, fps, frame_size, preset=preset, crf=crf, threads=threads, ffmpeg=ffmpeg)
+        if encoder == 'ffmpeg':
+            logging.getLogger().warning("ffmpeg was not found, encoding " + filename + " with cv2")
+    #fourcc = cv2.VideoWriter_fourcc(*'H264') #important for browser support, MP4V is not working with browsers
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    return cv2.VideoWriter(filename, fourcc, fps, frame_size)
+
+def video_encoder_options(args):
+    '''
+    :return: keyword arguments of open_video_encoder given on the command line (see run_model)
+    '''
+    return {'encoder': getattr(args, 'video_encoder', 'auto'), 'preset': getattr(args, 'x264_preset', 'veryfast'),
+            'crf': getattr(args, 'x264_crf', 23), 'threads': getattr(args, 'encoder_threads', 0)}
+
+class FramePostProcessor(object):
+    '''
+    crop_image_button, cv2.resize, add_black_pixels and draw_black_box of the video frames in one step. The geometry is
+    computed once and every frame is resized into the same preallocated output, so the returned frame is only valid
+    until the next call.
+    '''
+
+    def __init__(self, crop_images = True, black_pixels = 80, width = 320, height = 420, part = 0.05,
+                 box_start = (368, 130), box_end = (470, 220)):
+        '''
+        :param crop_images: crop the bottom *part* of the frames, pad them with black_pixels and black out the box
+        :param box_start: first (row, column) of the black box over the score, see draw_black_box
+        :param box_end: last (row, column) of the black box
+        '''
+        self.crop_images = crop_images
+        self.part = part
+        self.size = (width, height)
+        if crop_images:
+            self.output = np.zeros((height + black_pixels, width, 3), np.uint8)
+            self.box = (slice(box_start[0], box_end[0] + 1), slice(box_start[1], box_end[1] + 1))
+        else:
+            self.output = np.zeros((height, width, 3), np.uint8)
+        # the padding rows below the resized frame are never written
+        self.resized = self.output[:height]
+
+    def __call__(self, image):
+        '''
+        :param image: uint8 BGR frame
+        :return: the post-processed frame, in the reused output buffer
+        '''
+        if image.dtype != np.uint8 or image.ndim != 3 or image.shape[2] != 3:
+            raise ValueError("Expected a uint8 frame with 3 channels, got " + str(image.dtype) + " " + str(image.shape))
+        if self.crop_images:
+            image_length = image.shape[0]
+            image = image[:image_length - int(image_length * self.part)]
+        resized = cv2.resize(image, self.size, dst=self.resized)
+        if not np.may_share_memory(resized, self.resized):
+            # cv2 allocated a new array instead of writing into the output buffer
+            self.resized[...] = resized
+        if self.crop_images:
+            self.output[self.box] = 0
+        return self.output
+
+class SummaryVideoWriter(object):
+    '''
+    Encodes the frames of a summary video, with black frames between states that are not successive.
+    Frames have to be written in state order.
+    '''
+
+    def __init__(self, filename, states=None, crop_images = True, black_pixels = 80, fps = 30, width = 320, height = 420,
+                 encoder_options = None):
+        '''
+        :param filename: path of the video
+        :param states: states of the summary, None for all states
+        :param crop_images: crop the bottom of the frames, pad them with black_pixels and black out the score
+        :param encoder_options: keyword arguments of open_video_encoder, see video_encoder_options
+        '''
+        self.states = None if states is None else set(int(state) for state in states)
+        self.post_processor = FramePostProcessor(crop_images=crop_images, black_pixels=black_pixels, width=width,
+                                                 height=height)
+        self.video = open_video_encoder(filename, fps, (width, height + black_pixels), **(encoder_options or {}))
+        self.black_frame = np.zeros((height + black_pixels, width, 3), np.uint8)
+        self.black_frame_number = int(fps)
+        self.old_state_index = None
+
+    def __contains__(self, state_index):
+        return self.states is None or state_index in self.states
+
+    def write(self, state_index, i):
+        '''
+        :param state_index: state of the frame
+        :param i: uint8 BGR frame, as returned by cv2.imread
+        '''
+        # check if the states are successive and insert black frames, if the are not
+        if self.old_state_index != None and state_index != self.old_state_index + 1 and state_index != self.old_state_index:
+            self.write_black_frames()
+        self.old_state_index = state_index
+
+        self.video.write(self.post_processor(i))
+
+    def write_black_frames(self):
+        '''
+        writes the black frames that separate two trajectories of the summary
+        '''
+        for n in range(self.black_frame_number):
+            self.video.write(self.black_frame)
+
+    def close(self):
+        self.video.release()
+
 def generate_video(args, image_folder, out_path, name="video.mp4", image_indices=None, crop_images = True, black_pixels = 80):
     ''' creates a video from images in a folder
     :param image_folder: folder containing the images
     :param out_path: output folder for the video
     :param name: name of the output video
-    :param image_indices: states to be included in the summary video
+    :param image_indices: states to be included in the summary video, None includes all states
     :return: nothing, but saves the video in the given path
     '''
     
@@ -235,73 +620,144 @@ def generate_video(args, image_folder, out_path, name="video.mp4", image_indices
     if not (os.path.isdir(image_folder)):
                 os.makedirs(image_folder)
     #            os.rmdir(image_folder)
-    images = [img for img in os.listdir(image_folder)]
-    images = natural_sort(images)
-    #fourcc = cv2.VideoWriter_fourcc(*'H264') #important for browser support, MP4V is not working with browsers
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    fps = 30
-    height, width, layers = 420,320,3
+    # only the frames of the summary states are visited, in state and frame order
+    images = folder_index(image_folder).frames(image_indices)
     if not (os.path.isdir(out_path)):
         os.makedirs(out_path)
-    video = cv2.VideoWriter(out_path + name, fourcc, fps, (width,height + black_pixels))
+    video = SummaryVideoWriter(out_path + name, crop_images=crop_images, black_pixels=black_pixels,
+                               encoder_options=video_encoder_options(args))
     if (args.verbose):
         logger.info("Just made video writer")
-    old_state_index = None
-    black_frame = np.zeros((height + black_pixels, width, layers),np.uint8)
-    black_frame_number = int(fps)
 
     # Make Movies
-    for image in images:
-        to_write = False
-        if (args.verbose):
-            logger.info("Not to write")
+    for state_index, frame, image in images:
         try:
-            image_str = image.split('_')
-            state_index = int(image_str[1])
-            if (args.verbose):
-                logger.info("Just broke up image string: " + str(state_index))
-            if (state_index in image_indices) or (image_indices is None):
-                if (args.verbose):
-                    logger.info("check if the states are successive and insert black frames, if the are not")
-                if old_state_index != None and state_index != old_state_index + 1 and state_index != old_state_index:
-                    for n in range(black_frame_number):
-                        if (args.verbose):
-                            logger.info("write a black frame")
-                        video.write(black_frame)
-                old_state_index = state_index
-
-                i = cv2.imread(os.path.join(image_folder, image))
-                if (args.verbose):
-                    logger.debug("IMREAD")
-                if crop_images:
-                    i = crop_image_button(i, part = 0.05)
-                    if (args.verbose):
-                        logger.info("Crop images")
-                i = cv2.resize(i, (width,height))
-                if (args.verbose):
-                    logger.info("Resize")
-                if crop_images:
-                    i = add_black_pixels(i, pixels=black_pixels)
-                    if (args.verbose):
-                        logger.info("Add black pixels")
-                if crop_images:
-                    i = draw_black_box(i)
-                to_write = True
+            i = frame_cache.cached_load((image_folder, 'bgr'), state_index, frame, os.path.join(image_folder, image), cv2.imread)
+            video.write(state_index, i)
         except Exception as e:
             print(e)
             if (args.verbose):
                 print('Try next image.')
             continue
-        if to_write:
-            if args.verbose:
-                logger.info("And to write is true")
-                logger.info("and i is " + str(image_str))
-            video.write(i)
-            if (args.verbose):
-                logger.info("And to write is true")
+        if args.verbose:
+            logger.info("Wrote " + str(image))
 
     cv2.destroyAllWindows()
-    video.release()
+    video.close()
+
+def generate_videos(args, image_folders, out_path, names, image_indices=None, crop_images = True, black_pixels = 80,
+                    prefetch = 2, leading_black_frames = False):
+    ''' generate_video for several image folders with the same summary states (e.g. screen_smooth, argmax_smooth and
+    blur_argmax). The frames of the summary are walked once and all videos are written in lockstep, the images of the
+    next frames are decoded concurrently while the current frame is encoded.
+    :param image_folders: folders containing the images, one per video
+    :param out_path: output folder for the videos
+    :param names: names of the output videos, one per image folder
+    :param image_indices: states to be included in the summary videos, None includes all states
+    :param prefetch: number of frames that are decoded ahead
+    :param leading_black_frames: if True the videos start with the black frames that separate trajectories (for all but
+    the first segment of a video that is encoded in segments)
+    :return: nothing, but saves the videos in the given path
+    '''
+    logger = logging.getLogger()
+    if not (os.path.isdir(out_path)):
+        os.makedirs(out_path)
+    # (state, frame) -> file name of every folder, the summary frames are the union of all folders
+    folder_files = []
+    for image_folder in image_folders:
+        folder_files.append({(state_index, frame): os.path.join(image_folder, image)
+                             for state_index, frame, image in folder_index(image_folder).frames(image_indices)})
+    summary_frames = sorted(set().union(*folder_files))
+    videos = [SummaryVideoWriter(os.path.join(out_path, name), crop_images=crop_images, black_pixels=black_pixels,
+                                 encoder_options=video_encoder_options(args)) for name in names]
+    if leading_black_frames:
+        for video in videos:
+            video.write_black_frames()
+
+    def read_images(key):
+        return [frame_cache.cached_load((image_folder, 'bgr'), key[0], key[1], files[key], cv2.imread) if key in files else None
+                for image_folder, files in zip(image_folders, folder_files)]
+
+    with ThreadPoolExecutor(max_workers=max(1, prefetch)) as executor:
+        pending = collections.deque()
+        for key in summary_frames:
+            pending.append((key, executor.submit(read_images, key)))
+            if len(pending) <= prefetch:
+                continue
+            write_summary_frame(args, videos, *pending.popleft())
+        while pending:
+            write_summary_frame(args, videos, *pending.popleft())
+    for video in videos:
+        video.close()
+    if args.verbose:
+        logger.info("Wrote " + str(len(summary_frames)) + " frames to " + ", ".join(names))
+        logger.info("Frame cache: " + str(frame_cache.stats()))
+
+def segment_encoding_supported(args):
+    '''
+    :return: True if summary videos can be encoded in segments, which are concatenated without re-encoding by ffmpeg
+    '''
+    return video_encoder_options(args)['encoder'] != 'cv2' and shutil.which('ffmpeg') is not None
+
+def summary_segments(image_folders, image_indices=None):
+    '''
+    splits the states of a summary into its trajectories, the runs of successive states between which SummaryVideoWriter
+    inserts black frames
+    :param image_folders: folders containing the images of the summary videos
+    :param image_indices: states to be included in the summary, None includes all states
+    :return: list with the sorted states of each trajectory
+    '''
+    states = sorted(set().union(*[set(state_index for state_index, _, _ in folder_index(image_folder).frames(image_indices))
+                                  for image_folder in image_folders]))
+    segments = []
+    for state_index in states:
+        if segments and state_index == segments[-1][-1] + 1:
+            segments[-1].append(state_index)
+        else:
+            segments.append([state_index])
+    return segments
+
+def segment_filename(filename, segment):
+    '''
+    :return: file name of a segment of the video filename
+    '''
+    root, extension = os.path.splitext(filename)
+    return root + '.part' + str(segment).zfill(4) + extension
+
+def concat_videos(segment_filenames, filename, remove_segments = True):
+    '''
+    concatenates videos with the same encoding settings without re-encoding (ffmpeg concat demuxer)
+    :param segment_filenames: videos in order, a video may be repeated
+    :param filename: path of the concatenated video
+    :param remove_segments: if True the segments are deleted afterwards
+    '''
+    list_filename = filename + '.segments.txt'
+    with open(list_filename, 'w') as list_file:
+        for segment in segment_filenames:
+            list_file.write("file '" + os.path.abspath(segment).replace("'", "'\\''") + "'\n")
+    command = [shutil.which('ffmpeg') or 'ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+               '-i', list_filename, '-c', 'copy', '-movflags', '+faststart', filename]
+    result = subprocess.run(command, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise IOError('ffmpeg failed to concatenate ' + filename + ': ' + result.stderr.decode(errors='replace').strip())
+    os.remove(list_filename)
+    if remove_segments:
+        for segment in set(segment_filenames):
+            os.remove(segment)
+
+def write_summary_frame(args, videos, key, images):
+    '''
+    writes the decoded images of one summary frame into their videos, images that are missing or broken are skipped
+    :param key: (state, frame) of the images
+    :param images: future of the list with one image (or None) per video
+    '''
+    state_index = key[0]
+    for video, image in zip(videos, images.result()):
+        if image is None:
+            if args.verbose:
+                print('Missing image of state ' + str(state_index) + ', try next image.')
+            continue
+        video.write(state_index, image)
 
 def natural_sort( l ):
     """ Sort the given list in natural sort (the way that humans expect).
@@ -323,6 +779,15 @@ def save_image(file_name,image):
         os.rmdir(file_name)
     plt.imsave(file_name, image)
 
+def save_frame(array, save_file, frame):
+    """
+    saves array as save_file_<frame>.png and creates the directory if it does not exist yet
+    """
+    if not (os.path.isdir(save_file)):
+        os.makedirs(save_file)
+        os.rmdir(save_file)
+    plt.imsave(save_file + '_' + str(frame) + '.png', array)
+
 #pass
 
 
@@ -0,0 +1,333 @@
+"""
+    Renders the smoothed screens and the saliency overlays of the frames of a stream (see overlay_frames).
+
+    Only needs the frames, the saliency maps and image_utils, so it can be used without loading the model, e.g. by the
+    preview process of summary_preview. overlay_stream runs it for the summaries of a stream.
+"""
+
+import coloredlogs, logging
+import os
+import cv2
+import numpy as np
+import image_utils
+import frame_cache
+from saliency_source import open_saliency_source, interpolate_quantized
+from concurrent.futures import ProcessPoolExecutor
+
+#folder of the frames of every overlay style (see image_utils.OVERLAY_STYLES), the selected styles are rendered in the
+#same pass over the frames
+STYLE_FOLDERS = {'green': 'argmax_smooth', 'blur': 'blur_argmax', 'edge': 'edge_argmax'}
+DEFAULT_OVERLAY_STYLES = ['green', 'blur']
+
+#number of frames whose overlays are rendered together
+OVERLAY_BATCH_SIZE = 16
+
+def overlay_manifest(folder, quantized=False):
+    '''
+    :param folder: output folder of the overlays, 'screen_smooth' or a folder of STYLE_FOLDERS
+    :param quantized: if the overlays are rendered from the quantized saliency maps, they differ slightly from the others
+    :return: name of the stage cache manifest of the states whose frames in the folder are rendered
+    '''
+    if folder == 'screen_smooth':
+        return 'overlay_screen_smooth'
+    return 'overlay_' + folder + ('_quantized' if quantized else '')
+
+def load_rendered_states(cache, styles, quantized=False):
+    '''
+    :param cache: StageCache of the stream
+    :return: dict output folder -> set of the states whose frames are already rendered into it
+    '''
+    folders = ['screen_smooth'] + [STYLE_FOLDERS[style] for style in styles]
+    return {folder: cache.load_states(overlay_manifest(folder, quantized)) for folder in folders}
+
+def add_rendered_states(cache, written, quantized=False):
+    '''
+    records which states are rendered into which output folder
+    :param written: dict output folder -> states whose frames were all written into it (see overlay_frames)
+    '''
+    for folder, states in written.items():
+        cache.add_states(overlay_manifest(folder, quantized), states)
+        if folder != 'screen_smooth':
+            # the frames of the other kind of saliency maps were overwritten
+            cache.remove_states(overlay_manifest(folder, not quantized), states)
+
+def interpolate(array1, array2, t):
+    '''
+    linear interpolation between two frames of a state
+    :param array1: starting array
+    :param array2: end array
+    :param t: time parameter, goes from -1 to 3 ( 0=0.25, 3=1 in the normal interpolation formula)
+    :return: the interpolated array
+    '''
+    t = (t * 0.25) + 0.25
+    return (array2 * t) + (array1 * (1 - t))
+    
+def frame_state(image):
+    '''
+    :param image: name of a screen image, screen_<state>_<frame>.png
+    :return: state index and frame index of the image
+    '''
+    image_str = image.split('_')
+    return int(image_str[1]), int(image_str[2].replace(".png", ""))
+
+def read_rgb(filename):
+    i = cv2.imread(filename)
+    return cv2.cvtColor(i, cv2.COLOR_BGR2RGB)
+
+def load_screen(image_folder, image):
+    '''
+    loads a screen as RGB, through the frame cache (see frame_cache)
+    '''
+    state_index, frame_index = frame_state(image)
+    return frame_cache.cached_load((image_folder, 'rgb'), state_index, frame_index, os.path.join(image_folder, image),
+                                   read_rgb)
+
+def load_saliency_map(args, raw_argmax_base, state_index):
+    '''
+    loads the normalised raw saliency map of a state through the frame cache (see frame_cache), maps that are almost
+    everywhere active are dropped
+    :return: the (read-only) saliency map
+    '''
+    logger = logging.getLogger()
+
+    def load(saliency_filename):
+        saliency_map = image_utils.normalise_image(np.load(saliency_filename))
+        if saliency_map.sum() > 0.9 * saliency_map.shape[0] * saliency_map.shape[1] * saliency_map.shape[2]:
+            if args.verbose:
+                logger.info("state index is: " + str(state_index))
+            saliency_map = np.zeros(saliency_map.shape)
+        return saliency_map
+
+    return frame_cache.cached_load((raw_argmax_base, 'normalised'), state_index, None,
+                                   raw_argmax_base + "_" + str(state_index) + ".npy", load)
+
+def write_video_frame(videos, image_folder, state_index, image):
+    '''
+    writes a rendered frame into all videos of the image folder that contain its state
+    :param videos: dict image folder -> list of image_utils.SummaryVideoWriter
+    '''
+    writers = [writer for writer in videos.get(image_folder, ()) if state_index in writer]
+    if writers:
+        frame = image_utils.frame_to_uint8(image)
+        for writer in writers:
+            writer.write(state_index, frame)
+
+def render_style(style, batch):
+    '''
+    renders one overlay style for a batch of frames. If the batch fails, e.g. because of a broken frame or saliency map,
+    its frames are rendered one by one and the broken ones are skipped, like overlay_frames skips broken images
+    :param batch: list of (state, frame, smoothed screen, saliency map, styles to render for the frame)
+    :return: list of (state, frame, overlay) of the rendered frames
+    '''
+    logger = logging.getLogger()
+    render = image_utils.get_overlay_style(style)
+    try:
+        overlays = render(np.stack([screen for _, _, screen, _, _ in batch]),
+                          np.stack([saliency for _, _, _, saliency, _ in batch]))
+        return [(state_index, frame_index, overlay) for (state_index, frame_index, _, _, _), overlay in zip(batch, overlays)]
+    except Exception as e:
+        logger.error(e)
+        if len(batch) == 1:
+            logger.error('Try next image.')
+            return []
+        logger.error('Rendering the frames of the batch one by one.')
+    return [rendered for item in batch for rendered in render_style(style, [item])]
+
+def render_overlay_batch(stream_folder, batch, styles, videos=None, save_frames=True):
+    '''
+    renders the overlay styles for a batch of frames and saves them or writes them into the videos
+    :param batch: list of (state, frame, smoothed screen, saliency map, styles to render for the frame) in state and
+    frame order
+    :param styles: names of the overlay styles, in the order they are rendered
+    :return: dict style folder -> set of the states with a frame that could not be rendered or written
+    '''
+    logger = logging.getLogger()
+    failed = {}
+    for style in styles:
+        style_batch = [item for item in batch if style in item[4]]
+        if not style_batch:
+            continue
+        style_folder = STYLE_FOLDERS[style]
+        rendered = render_style(style, style_batch)
+        rendered_frames = set((state_index, frame_index) for state_index, frame_index, _ in rendered)
+        failed_states = set(item[0] for item in style_batch if (item[0], item[1]) not in rendered_frames)
+        for state_index, frame_index, overlay in rendered:
+            try:
+                if save_frames:
+                    index = str(state_index) + '_' + str(frame_index)
+                    image_utils.save_frame(overlay, os.path.join(stream_folder, style_folder, 'argmax'), index)
+                if videos:
+                    write_video_frame(videos, style_folder, state_index, overlay)
+            except Exception as e:
+                logger.error(e)
+                logger.error('Try next image.')
+                failed_states.add(state_index)
+        if failed_states:
+            failed[style_folder] = failed_states
+    return failed
+
+def overlay_frames(args, stream_folder, images, states_to_overlay, rendered_states=None, previous_image=None, videos=None,
+                   save_frames=True, styles=None, quantized=False):
+    '''
+    renders the smoothed screens and the overlay styles in one pass over the frames. Every frame and saliency map is
+    decoded once, the styles are rendered for batches of OVERLAY_BATCH_SIZE frames.
+    :param images: names of the screen images, sorted by state and frame (see stream_index)
+    :param states_to_overlay: states whose frames are rendered
+    :param rendered_states: dict output folder -> states whose frames already exist in it (see load_rendered_states),
+    states that exist in all folders only update the smoothing and interpolation state
+    :param previous_image: the last image that was overlaid before images, its frame and saliency map start the
+    smoothing and interpolation (see overlay_segments)
+    :param videos: optional dict image folder -> list of image_utils.SummaryVideoWriter, the rendered frames are written
+    straight into the videos that contain their state (see video_generation.open_summary_videos)
+    :param save_frames: if False the rendered frames are only written into the videos, not saved as png
+    :param styles: names of the overlay styles to render, None for DEFAULT_OVERLAY_STYLES
+    :param quantized: if True the uint8 saliency maps of saliency_source are used (see read_saliency_source), and
+    interpolated in fixed point
+    :return: dict output folder -> set of the states whose frames were all written into it by this call, states with
+    a frame that failed are left out
+    '''
+    logger = logging.getLogger()
+    image_folder = os.path.join(stream_folder, 'screen')
+    raw_argmax_base = os.path.join(stream_folder, 'raw_argmax', 'raw_argmax')
+    screen_folder = os.path.join(stream_folder, 'screen_smooth')
+    styles = DEFAULT_OVERLAY_STYLES if styles is None else styles
+    rendered_states = {} if rendered_states is None else rendered_states
+    saliency_source = open_saliency_source(stream_folder) if quantized else None
+    folders = ['screen_smooth'] + [STYLE_FOLDERS[style] for style in styles]
+    written = dict((folder, set()) for folder in folders)
+    failed = dict((folder, set()) for folder in folders)
+    batch = []
+    old_saliency_map = None
+    old_image = None
+    frame_maps_state = None
+    if previous_image is not None:
+        previous_state, previous_frame = frame_state(previous_image)
+        old_image = load_screen(image_folder, previous_image)
+        # interpolating at the last frame (3) returns the saliency map of the state itself
+        if previous_frame == 3 and quantized:
+            old_saliency_map = saliency_source[previous_state]
+        elif previous_frame == 3:
+            old_saliency_map = load_saliency_map(args, raw_argmax_base, previous_state)
+    for image in images:
+        state_index = None
+        try:
+            state_index, frame_index = frame_state(image)
+
+            if state_index not in states_to_overlay:
+                continue
+            if args.verbose:
+                logger.info("State " + str(state_index) + " is in the list of states to overlay")
+            i = load_screen(image_folder, image)
+            if old_image is not None:
+                smooth_i = np.maximum(old_image,i)
+                old_image = i
+                i = smooth_i
+            else:
+                old_image = i
+
+            if state_index not in rendered_states.get('screen_smooth', ()):
+                if save_frames:
+                    image_utils.save_image(os.path.join(screen_folder, image), i)
+                if videos:
+                    write_video_frame(videos, 'screen_smooth', state_index, i)
+                written['screen_smooth'].add(state_index)
+
+            frame_styles = [style for style in styles if state_index not in rendered_states.get(STYLE_FOLDERS[style], ())]
+            for style in frame_styles:
+                written[STYLE_FOLDERS[style]].add(state_index)
+            if quantized:
+                # the maps of all four frames of a state are interpolated at once
+                if state_index != frame_maps_state:
+                    frame_maps = interpolate_quantized(old_saliency_map, saliency_source[state_index])
+                    frame_maps_state = state_index
+                saliency_map = frame_maps[frame_index]
+                if frame_styles:
+                    batch.append((state_index, frame_index, i, saliency_map, frame_styles))
+            else:
+                # the map is loaded once for the four frames of its state
+                if state_index != frame_maps_state:
+                    state_saliency_map = load_saliency_map(args, raw_argmax_base, state_index)
+                    frame_maps_state = state_index
+                saliency_map = state_saliency_map
+                if old_saliency_map is not None:
+                    saliency_map = interpolate(old_saliency_map, saliency_map, frame_index)
+                if frame_styles:
+                    batch.append((state_index, frame_index, i, saliency_map[:, :, 3], frame_styles))
+            if frame_index == 3:
+                old_saliency_map = saliency_map
+        except Exception as e:
+            logger.error(e)
+            logger.error('Try next image.')
+            if state_index is not None:
+                for folder in folders:
+                    failed[folder].add(state_index)
+            continue
+        if len(batch) >= OVERLAY_BATCH_SIZE:
+            for folder, states in render_overlay_batch(stream_folder, batch, styles, videos, save_frames).items():
+                failed[folder].update(states)
+            batch = []
+    if batch:
+        for folder, states in render_overlay_batch(stream_folder, batch, styles, videos, save_frames).items():
+            failed[folder].update(states)
+    return dict((folder, written[folder] - failed[folder]) for folder in folders)
+
+def overlay_segments(images, states_to_overlay):
+    '''
+    splits the frames of the states to overlay into contiguous trajectory segments
+    :param images: names of the screen images, sorted by state and frame
+    :param states_to_overlay: states whose frames are rendered
+    :return: list of (last image of the previous segment or None, images of the segment)
+    '''
+    segments = []
+    previous_image = None
+    previous_state = None
+    for image in images:
+        try:
+            state_index, _ = frame_state(image)
+        except (IndexError, ValueError):
+            continue
+        if state_index not in states_to_overlay:
+            continue
+        if previous_state is None or (state_index != previous_state and state_index != previous_state + 1):
+            segments.append((previous_image, []))
+        segments[-1][1].append(image)
+        previous_image = image
+        previous_state = state_index
+    return segments
+
+def overlay_frames_parallel(args, stream_folder, images, states_to_overlay, rendered_states=None, styles=None, quantized=False):
+    '''
+    renders the overlays like overlay_frames, with every contiguous trajectory segment rendered by a worker process.
+    Each segment starts its smoothing and interpolation from the last frame of the segment before it, so the images
+    are the same as with overlay_frames.
+    :return: dict output folder -> set of the states whose frames were all written into it, the states of a segment
+    whose worker failed are left out
+    '''
+    logger = logging.getLogger()
+    rendered_states = {} if rendered_states is None else rendered_states
+    styles = DEFAULT_OVERLAY_STYLES if styles is None else styles
+    folders = ['screen_smooth'] + [STYLE_FOLDERS[style] for style in styles]
+    segments = overlay_segments(images, states_to_overlay)
+    if args.verbose:
+        logger.info("Rendering " + str(len(segments)) + " segments with " + str(args.workers) + " workers")
+    # the workers split the size of this process's frame cache among themselves
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=frame_cache.configure,
+                             initargs=(frame_cache.worker_budget(args.workers),)) as executor:
+        futures = []
+        for previous_image, segment_images in segments:
+            segment_states = set(frame_state(image)[0] for image in segment_images)
+            segment_rendered = {folder: segment_states.intersection(rendered_states.get(folder, ())) for folder in folders}
+            if all(segment_rendered[folder] == segment_states for folder in folders):
+                continue
+            futures.append(executor.submit(overlay_frames, args, stream_folder, segment_images, segment_states,
+                                           segment_rendered, previous_image, styles=styles, quantized=quantized))
+        written = dict((folder, set()) for folder in folders)
+        for future in futures:
+            try:
+                segment_written = future.result()
+            except Exception as e:
+                logger.error("Rendering a segment failed: " + str(e))
+                continue
+            for folder, states in segment_written.items():
+                written[folder].update(states)
+    return written
@@ -10,53 +10,30 @@ import image_utils
 import pandas as pd
 import cv2
 import numpy as np
-import stream_generator
 import video_generation as video_generation
 import tensorflow as tf
-from highlights_state_selection import read_q_value_files, read_feature_files, compute_states_importance, highlights_div, random_state_selection, read_input_files
-from video_generation import get_key_states
+from highlights_state_selection import read_q_value_files, read_feature_files, compute_states_importance, highlights_div, random_state_selection, random_state_selections, read_input_files
+from video_generation import get_key_states, read_state_features_importance, SUMMARY_FEATURES
 from tracker import Tracker
+from stage_cache import StageCache
+from stream_index import StreamIndex
+import frame_cache
+from saliency_source import read_saliency_source
+from overlay_rendering import STYLE_FOLDERS, DEFAULT_OVERLAY_STYLES, load_rendered_states, add_rendered_states, overlay_frames, overlay_frames_parallel
 
 #random seeds for the random summaries
 seeds=[ 42, 1337, 1, 7, 13, 21, 153, 90,19234761, 291857957]
 
-def interpolate(array1, array2, t):
-    '''
-    linear interpolation between two frames of a state
-    :param array1: starting array
-    :param array2: end array
-    :param t: time parameter, goes from -1 to 3 ( 0=0.25, 3=1 in the normal interpolation formula)
-    :return: the interpolated array
-    '''
-    t = (t * 0.25) + 0.25
-    return (array2 * t) + (array1 * (1 - t))
-    
 def get_random_states_list(args, logger, key_states_with_context):
     ''' Get a list of all the states we need saliency overlays for,
-        to save on computation of overlaying everything '''
+        to save on computation of overlaying everything.
+        All args.random_summaries random summaries are drawn at once, so the overlays for their union
+        only have to be rendered once '''
         
-    state_features_importance_df = pd.read_csv(args.stream_folder + '/state_features_importance.csv')
+    state_features_importance_df = read_state_features_importance(args.stream_folder, columns=['state'])
     
-    consolidated_random_states_list_without_repeats = []
-    random_states = []
-    random_states_with_context = []
-    for i in range(1):
-        seed = seeds[i]
-        random_states_item, random_states_with_context_item = random_state_selection(state_features_importance_df, args.trajectories, args.context, args.minimum_gap,seed=seed)
-        if args.verbose:
-            logger.debug("Generated random state: ")
-            logger.debug(random_states_item)
-            logger.debug("With context: ")
-            logger.debug(random_states_with_context_item)
-        random_states.append(random_states_item)
-        random_states_with_context.append(random_states_with_context_item)
-        print("Random state item is ")
-        print(random_states_with_context_item)
-        print("Of type: ")
-        print(type(random_states_with_context_item))
-        for state_number in random_states_with_context[i]:
-            if state_number not in consolidated_random_states_list_without_repeats:
-                consolidated_random_states_list_without_repeats.append(state_number)
+    random_states, random_states_with_context, consolidated_random_states_list_without_repeats = random_state_selections(
+        state_features_importance_df, args.trajectories, args.context, args.minimum_gap, seeds[:args.random_summaries])
     
     if args.verbose:
         logger.debug("Randome states:")
@@ -65,9 +42,6 @@ def get_random_states_list(args, logger, key_states_with_context):
         logger.debug(random_states_with_context)
         logger.debug("Consolidated list: ")
         logger.debug(consolidated_random_states_list_without_repeats)
-    ls = [type(item) for item in random_states_with_context]
-    print("Type of random list before returned from get random states in overlay stream is:")
-    print(ls)
     return random_states, random_states_with_context, consolidated_random_states_list_without_repeats
 
 def overlay_stream(args):
@@ -83,125 +57,74 @@ def overlay_stream(args):
     logger.setLevel(logging.DEBUG)
     
     stream_folder = args.stream_folder
-    image_folder = stream_folder + "/screen"
-    raw_argmax_base = stream_folder + "/raw_argmax/raw_argmax"
-    save_folder = stream_folder + "/argmax_smooth"
-    save_folder2 = stream_folder + "/screen_smooth"
-    save_folder3 = stream_folder + "/blur_argmax"
-    if not (os.path.isdir(save_folder2)):
-        os.makedirs(save_folder2)
-    if not (os.path.isdir(save_folder3)):
-        os.makedirs(save_folder3)
+    styles = args.overlay_styles
+    for save_folder in ['screen_smooth'] + [STYLE_FOLDERS[style] for style in styles]:
+        if not (os.path.isdir(os.path.join(stream_folder, save_folder))):
+            os.makedirs(os.path.join(stream_folder, save_folder))
 
-    images = [img for img in os.listdir(image_folder)]
-    images = image_utils.natural_sort(images)
-    
-    key_states_with_context = get_key_states(args, stream_folder, features='input', load_states=False)
+    key_states_with_context = get_key_states(args, stream_folder, features=SUMMARY_FEATURES, load_states=False)
     
     np.set_printoptions(threshold=sys.maxsize)
     with pd.option_context('display.max_rows', None, 'display.max_columns', None):
         print("Traditionally generated key states with context: ")
         print(key_states_with_context)
 
-    if args.verbose:
-        logger.debug("make original saliency maps for all necessary states")
-    old_saliency_map = None
-    old_image = None
-    for image in images:
-        try:
-            image_str = image.split('_')
-            state_index = int(image_str[1])
-            frame_index = int(image_str[2].replace(".png", ""))
-            
-            if args.verbose:
-                logger.info("About to compare state " + str(state_index) + " to consolidated_random_states_list_without_repeats list....")
+    # overlays for the random summaries are rendered together with the key states
+    random_states_with_context = []
+    states_to_overlay = set(key_states_with_context)
+    if args.random_summaries > 0:
+        _, random_states_with_context, random_union = get_random_states_list(args, logger, key_states_with_context)
+        states_to_overlay.update(random_union)
 
-            if (state_index in key_states_with_context) or (key_states_with_context is None):
-                if args.verbose:
-                    logger.info("State " + str(state_index) + " is in consolidated_random_states_list_without_repeats list: " + str(key_states_with_context))
-                i = cv2.imread(os.path.join(image_folder, image))
-                i = cv2.cvtColor(i, cv2.COLOR_BGR2RGB)
-                if old_image is not None:
-                    smooth_i = np.maximum(old_image,i)
-                    old_image = i
-                    i = smooth_i
-                else:
-                    old_image = i
+    # overlays of states that were rendered by an earlier run on this stream are not rendered again, every style has
+    # its own manifest. Their frames and saliency maps are still loaded, so the smoothing of the following frames is
+    # the same as in a full run
+    quantized = args.quantized_saliency
+    cache = StageCache(stream_folder)
+    rendered_states = load_rendered_states(cache, styles, quantized)
+    # only the frames of the states to overlay are visited
+    images = [image for _, _, image in StreamIndex(stream_folder).artifact('screen').frames(states_to_overlay)]
+    if args.verbose:
+        for folder, rendered in rendered_states.items():
+            logger.info(folder + ": " + str(len(states_to_overlay - rendered)) + " of " + str(len(states_to_overlay)) + " states need new frames")
 
-                image_utils.save_image(os.path.join(save_folder2, image) ,i)
+    if quantized:
+        # quantizes the maps of states that are not in the file yet
+        read_saliency_source(stream_folder, workers=args.workers)
 
-                saliency_filename = raw_argmax_base + "_" + str(state_index) + ".npy"
-                saliency_map = np.load(saliency_filename)
-                saliency_map = image_utils.normalise_image(saliency_map)
-                if saliency_map.sum() > 0.9 * saliency_map.shape[0] * saliency_map.shape[1] * saliency_map.shape[2]:
-                    if args.verbose:
-                        logger.info(state_index)
-                    saliency_map = np.zeros(saliency_map.shape)
-                if old_saliency_map is not None:
-                    saliency_map = interpolate(old_saliency_map, saliency_map, frame_index)
-                saliency = image_utils.output_saliency_map(saliency_map[:, :, 3], i, edges=False)
-                index = str(state_index) + '_' + str(frame_index)
-                stream_generator.save_frame(saliency, save_folder + "/argmax", index)
-                if frame_index == 3:
-                    old_saliency_map = saliency_map
-        except Exception as e:
-            logger.error(e)
-            logger.error('Try next image.')
-            continue
-            
-    if args.verbose:
-        logger.debug("make blur-based saliency maps for all necessary states")
-    old_saliency_map = None
-    old_image = None
-    for image in images:
+    direct_video = args.generate_video is True and args.direct_video
+    if direct_video:
+        # the overlays are rendered straight into the video encoders, all states are rendered since their frames are
+        # needed for the videos
+        if args.verbose:
+            logger.debug("render the saliency overlays straight into the summary videos")
+        videos = video_generation.open_summary_videos(args, stream_folder, key_states_with_context, random_states_with_context)
         try:
-            image_str = image.split('_')
-            state_index = int(image_str[1])
-            frame_index = int(image_str[2].replace(".png", ""))
-            
-            if args.verbose:
-                logger.info("About to compare " + str(state_index) + " to consolidated_random_states_list_without_repeats list....")
-            
-#            image_indices = [4,5,6,7]
-            if (state_index in key_states_with_context) or (key_states_with_context is None):
-                if args.verbose:
-                    logger.info("State " + str(state_index) + " is in consolidated_random_states_list_without_repeats list: " + str(key_states_with_context))
-                i = cv2.imread(os.path.join(image_folder, image))
-                i = cv2.cvtColor(i, cv2.COLOR_BGR2RGB)
-                if old_image is not None:
-                    smooth_i = np.maximum(old_image,i)
-                    old_image = i
-                    i = smooth_i
-                else:
-                    old_image = i
+            written = overlay_frames(args, stream_folder, images, states_to_overlay, videos=videos,
+                                     save_frames=args.save_overlay_frames, styles=styles, quantized=quantized)
+        finally:
+            for writers in videos.values():
+                for writer in writers:
+                    writer.close()
+        if args.save_overlay_frames:
+            add_rendered_states(cache, written, quantized)
+    else:
+        if args.verbose:
+            logger.debug("make the saliency overlays for all necessary states")
+        if args.workers is not None and args.workers > 1:
+            written = overlay_frames_parallel(args, stream_folder, images, states_to_overlay, rendered_states, styles,
+                                              quantized)
+        else:
+            written = overlay_frames(args, stream_folder, images, states_to_overlay, rendered_states, styles=styles,
+                                     quantized=quantized)
 
-                image_utils.save_image(os.path.join(save_folder, image) ,i)
+        add_rendered_states(cache, written, quantized)
+    if args.verbose:
+        logger.info("Frame cache: " + str(frame_cache.stats()))
 
-                saliency_filename = raw_argmax_base + "_" + str(state_index) + ".npy"
-                saliency_map = np.load(saliency_filename)
-                saliency_map = image_utils.normalise_image(saliency_map)
-                if saliency_map.sum() > 0.9 * saliency_map.shape[0] * saliency_map.shape[1] * saliency_map.shape[2]:
-                    if args.verbose:
-                        logger.info("state index is: " + str(state_index))
-                    saliency_map = np.zeros(saliency_map.shape)
-                if old_saliency_map is not None:
-                    saliency_map = interpolate(old_saliency_map, saliency_map, frame_index)
-                saliency = image_utils.output_blur_saliency_map(saliency_map[:, :, 3], i, edges=False)
-                index = str(state_index) + '_' + str(frame_index)
-                stream_generator.save_frame(saliency, save_folder3 + "/argmax", index)
-                if frame_index == 3:
-                    old_saliency_map = saliency_map
-        except Exception as e:
-            logger.error(e)
-            logger.error('Try next image.')
-            continue
-            
-    if args.generate_video is True:
+    if args.generate_video is True and not direct_video:
         print("Calling generate videos")
-        ls = [type(item) for item in key_states_with_context]
-        print("Type of random list before being passed is:")
-        print(ls)
-        video_generation.generate_videos(args, key_states_with_context)
+        video_generation.generate_videos(args, random_states_with_context)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,144 @@
+"""
+    Finds Ms. Pac-Man and the ghosts in the 128 byte RAM of the Atari emulator instead of the screen.
+
+    The positions of Ms. Pac-Man and the four ghosts are stored in the RAM (see the MsPacman annotations of AtariARI and
+    OCAtari), so no background subtraction, edge detection or contour matching is needed. Frightened (blue) ghosts are
+    found by sampling the colour of the screen at the five pixels around each ghost, like Tracker does for its contours.
+    The characters and blue ghosts are returned as the same Character lists as Tracker.wheresPacman, with screen
+    coordinates, so DataVault.store_data works unchanged.
+
+    The power pills are not read from the RAM, no address is annotated for them. Like with Tracker, DataVault derives
+    the distances to the pills and whether they are eaten from the position of Ms. Pac-Man and its fixed pill locations.
+
+    The screen offsets of the RAM positions are checked against the colours of the characters on a recorded frame
+    (position_errors, check_offsets), calibrate_offsets estimates them from recorded frames.
+"""
+
+import logging
+import numpy as np
+from characters import match_colours
+from tracker import Tracker, copy_character, sample_colours
+
+#rows of the 210 x 160 screen that show the maze, the score and the lives are below it
+MAZE_ROWS = 172
+
+class RamTracker(object):
+    # RAM addresses of the x and y positions of Ms. Pac-Man, Blinky (red), Pinky (pink), Inky (blue) and Sue (orange),
+    # in the order of Tracker.CHARACTERS
+    X_ADDRESSES = [10, 9, 8, 7, 6]
+    Y_ADDRESSES = [16, 15, 14, 13, 12]
+    # RAM position + offset = centre of the sprite on the 210 x 160 screen, where Tracker finds the contour centroids.
+    # Not calibrated on the emulator yet, check_offsets warns if they are off
+    X_OFFSET = -9
+    Y_OFFSET = 6
+    # largest distance in pixels between a RAM position and the colour centre of its character (see check_offsets)
+    OFFSET_TOLERANCE = 4
+
+    # initialise the tracker, create one tracker per environment and keep it for the whole rollout
+    def __init__(self, x_offset=X_OFFSET, y_offset=Y_OFFSET):
+        self.x_offset = x_offset
+        self.y_offset = y_offset
+        # the same characters and blue ghosts as Tracker, with their own state
+        self.CHARACTERS = [copy_character(character) for character in Tracker.CHARACTERS]
+        self.BGS = [copy_character(bg) for bg in Tracker.BGS]
+        self.SAMPLE_COUNTER = 0
+
+    def positions(self, ram):
+        '''
+        :param ram: the RAM of the emulator, e.g. env.unwrapped.ale.getRAM()
+        :return: int array with the (x, y) screen positions of the CHARACTERS
+        '''
+        ram = np.asarray(ram, dtype=int)
+        return np.stack([ram[self.X_ADDRESSES] + self.x_offset, ram[self.Y_ADDRESSES] + self.y_offset], axis=1)
+
+    def position_errors(self, ram, frame):
+        '''
+        :param ram: the RAM of the emulator
+        :param frame: the RGB screen of the same step
+        :return: float array with the (x, y) differences between the RAM positions and the colour centres of the
+        CHARACTERS on the frame (see colour_positions), NaN for characters that are not visible
+        '''
+        return self.positions(ram) - colour_positions(frame, self.CHARACTERS)
+
+    def check_offsets(self, ram, frame):
+        '''
+        compares the RAM positions with the characters on a recorded frame and logs a warning if they are further apart
+        than OFFSET_TOLERANCE
+        :return: True if all visible characters are within OFFSET_TOLERANCE, False if not, None if no character is
+        visible on the frame
+        '''
+        logger = logging.getLogger()
+        errors = self.position_errors(ram, frame)
+        visible = ~np.isnan(errors).any(axis=1)
+        if not visible.any():
+            return None
+        if (np.abs(errors[visible]) <= self.OFFSET_TOLERANCE).all():
+            return True
+        logger.warning("The RAM positions of the characters are off by " + str(errors.tolist()) + " pixels (x, y) "
+                       "from their colours on the screen, check X_OFFSET and Y_OFFSET (see calibrate_offsets)")
+        return False
+
+    def wheresPacman(self, ram, frame=None):
+        '''
+        Tracker.wheresPacman from the RAM. Like with Tracker, ghosts that are blue are stored in BGS (in the order they
+        are found, at most four) and their coloured character keeps its last position.
+        :param ram: the RAM of the emulator
+        :param frame: the RGB screen of the same step, used to find blue ghosts. If None no ghost is blue.
+        :return: list of the characters and list of the blue ghosts (Character objects)
+        '''
+        positions = self.positions(ram)
+        frightened = np.zeros(len(positions), dtype=bool)
+        if frame is not None:
+            samples = sample_colours(frame, positions, Tracker.SAMPLE_OFFSETS)
+            frightened = match_colours(samples, self.BGS[:1])[..., 0].any(axis=1)
+            # Ms. Pac-Man is never blue
+            frightened[0] = False
+
+        bg_counter = 0
+        for character, position, blue in zip(self.CHARACTERS, positions, frightened):
+            if blue:
+                if bg_counter < len(self.BGS):
+                    bg = self.BGS[bg_counter]
+                    bg.set_coordinates(position)
+                    bg.direction = bg.get_direction()
+                    bg_counter = bg_counter + 1
+                continue
+            character.set_coordinates(position)
+            character.direction = character.get_direction()
+
+        self.SAMPLE_COUNTER += 1
+        return self.CHARACTERS, self.BGS
+
+
+def colour_positions(frame, characters, rows=MAZE_ROWS):
+    '''
+    finds the characters on a single frame by their colour, without background subtraction
+    :param frame: RGB screen
+    :param characters: list of Character
+    :param rows: only the rows of the maze are searched, the lives below it have the colour of Ms. Pac-Man
+    :return: float array with the (x, y) centre of the pixels of every character, NaN if its colour is not on the frame
+    '''
+    matches = match_colours(frame[:rows], characters)
+    positions = np.full((len(characters), 2), np.nan)
+    for index in range(len(characters)):
+        ys, xs = np.nonzero(matches[..., index])
+        if len(xs):
+            positions[index] = (xs.mean(), ys.mean())
+    return positions
+
+
+def calibrate_offsets(rams, frames):
+    '''
+    estimates RamTracker.X_OFFSET and Y_OFFSET from recorded steps
+    :param rams: the RAM of every step
+    :param frames: the RGB screen of the same steps
+    :return: (x offset, y offset), the median difference between the colour centres of the visible characters and
+    their RAM positions
+    '''
+    tracker = RamTracker(x_offset=0, y_offset=0)
+    differences = np.concatenate([-tracker.position_errors(ram, frame) for ram, frame in zip(rams, frames)])
+    differences = differences[~np.isnan(differences).any(axis=1)]
+    if not len(differences):
+        raise ValueError("No character is visible on the frames")
+    x_offset, y_offset = np.round(np.median(differences, axis=0)).astype(int)
+    return int(x_offset), int(y_offset)
@@ -10,6 +10,8 @@ from keras.models import Model
 import stream_generator as stream_generator
 import overlay_stream as overlay_stream
 import video_generation as video_generation
+import frame_cache
+from feature_source import DEFAULT_FEATURE_DTYPE
 
 import joblib
 import os
@@ -68,9 +70,31 @@ def main():
     parser.add_argument('--trajectories', type=float, default=5, help='length of summary - note this includes only the important states')
     parser.add_argument('--context', type=float, default=15, help='how many states to show around the chosen important state')
     parser.add_argument('--minimum-gap', type=float, default=15, help='how many states should we skip after showing the context for an important state.')
+    parser.add_argument('--random-summaries', type=int, default=0, help='number of random baseline summaries (0 to 10, one per seed of overlay_stream.seeds) rendered next to the HIGHLIGHTS-DIV summary')
+    parser.add_argument('--feature-dtype', type=str, default=DEFAULT_FEATURE_DTYPE, choices=['float64', 'float32', 'uint8'], help='dtype in which the network inputs are stored for HIGHLIGHTS-DIV, float32 and uint8 save memory but can change the selected states')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes used by the parallel stages')
+    parser.add_argument('--extend-stream', action='store_true', help='appends the new steps to an existing --stream-folder, only the new states are processed by the later stages')
+    parser.add_argument('--direct-video', action='store_true', help='with --generate-video, renders the overlays straight into the summary videos instead of saving and reading back png frames')
+    parser.add_argument('--save-overlay-frames', action='store_true', help='with --direct-video, also saves the overlay frames as png')
+    parser.add_argument('--overlay-styles', nargs='+', default=['green', 'blur'], choices=['green', 'blur', 'edge'], help='overlay styles rendered for every frame, green goes to argmax_smooth, blur to blur_argmax and edge to edge_argmax')
+    parser.add_argument('--quantized-saliency', action='store_true', help='renders the overlays from uint8 saliency maps with fixed point interpolation and lookup tables')
+    parser.add_argument('--video-encoder', type=str, default='auto', choices=['auto', 'ffmpeg', 'cv2'], help='encoder of the summary videos, ffmpeg pipes the frames to libx264 (plays in browsers), auto uses ffmpeg if it is installed and cv2 (mp4v) otherwise')
+    parser.add_argument('--x264-preset', type=str, default='veryfast', help='libx264 preset of the ffmpeg encoder')
+    parser.add_argument('--x264-crf', type=int, default=23, help='libx264 constant rate factor of the ffmpeg encoder, lower is better quality')
+    parser.add_argument('--encoder-threads', type=int, default=0, help='threads of each ffmpeg encoder, 0 lets ffmpeg choose')
+    parser.add_argument('--segment-videos', action='store_true', help='encodes every trajectory of the summaries in its own worker process and concatenates the segments without re-encoding, needs ffmpeg')
+    parser.add_argument('--preview', action='store_true', help='renders a provisional summary into stream-folder/preview/preview.mp4 while the stream is generated')
+    parser.add_argument('--preview-interval', type=float, default=120, help='seconds between two preview updates')
+    parser.add_argument('--preview-cpu-share', type=float, default=0.25, help='share of one core the preview process may use on average')
+    parser.add_argument('--frame-cache-mb', type=int, default=512, help='size of the cache of decoded frames in MB, worker processes split it among themselves, 0 disables it')
+    parser.add_argument('--tracker', type=str, default='vision', choices=['vision', 'ram'], help='finds the characters on the screen (vision) or in the RAM of the emulator (ram, MsPacman only, the power pills are still derived from the position of Ms. Pac-Man)')
+    parser.add_argument('--tracker-debug-every', type=int, default=0, help='every n-th step the tracker draws and prints the found characters and saves them to pacman.jpg, 0 never')
 
 
     args = parser.parse_args()
+    if not 0 <= args.random_summaries <= len(overlay_stream.seeds):
+        parser.error('--random-summaries must be between 0 and ' + str(len(overlay_stream.seeds)) + ', one summary per seed')
+    frame_cache.configure(args.frame_cache_mb * 2**20)
     
     # get current directory
     path = os.getcwd()
@@ -0,0 +1,99 @@
+"""
+    Quantized saliency maps for rendering the overlays.
+
+    The overlays only use the last channel of the normalised raw_argmax maps. That channel is stored as uint8 (with the
+    scale 1/255 in the header) for all states in one state array file (see state_arrays), so a map takes 84*84 bytes
+    instead of 84*84*4 float64 values. Maps of new states are added to the file incrementally, like the network inputs
+    (see feature_source). Interpolating between the maps of successive states is done in fixed point for all four
+    frames of a state at once.
+"""
+
+import os
+import numpy as np
+from state_arrays import consolidate_state_files, read_state_array_file
+from highlights_state_selection import list_state_files
+
+#channel of the saliency maps the overlays use
+SALIENCY_CHANNEL = 3
+SALIENCY_SCALE = 1.0 / 255
+SALIENCY_FILE = 'raw_argmax_uint8.bin'
+
+
+def quantize_saliency_map(saliency_map, channel=SALIENCY_CHANNEL):
+    '''
+    normalises a raw saliency map like image_utils.normalise_image and quantizes one channel to uint8. Maps that are
+    almost everywhere active (more than 90% of the normalised sum) are dropped, like in overlay_rendering.load_saliency_map.
+    :param saliency_map: raw (h, w, channels) saliency map
+    :return: (h, w) uint8 map, the normalised values times 255
+    '''
+    saliency_map = np.asarray(saliency_map)
+    minimum = saliency_map.min()
+    value_range = float(saliency_map.max()) - float(minimum)
+    if value_range == 0:
+        return np.zeros(saliency_map.shape[:2], dtype=np.uint8)
+    # the sum of the normalised map, without materializing it
+    normalised_sum = (float(saliency_map.sum(dtype=np.float64)) - saliency_map.size * float(minimum)) / value_range
+    if normalised_sum > 0.9 * saliency_map.size:
+        return np.zeros(saliency_map.shape[:2], dtype=np.uint8)
+    scale = np.float32(255 / value_range)
+    channel_map = (saliency_map[:, :, channel] - minimum) * scale
+    return np.clip(np.rint(channel_map), 0, 255).astype(np.uint8)
+
+
+def interpolate_quantized(old_map, new_map):
+    '''
+    overlay_rendering.interpolate for all four frames of a state at once, in fixed point
+    :param old_map: uint8 map of the previous state, None if there is none
+    :param new_map: uint8 map of the state
+    :return: (4, h, w) uint8 maps of the frames 0 to 3 (frame 3 is new_map itself)
+    '''
+    if old_map is None:
+        return np.broadcast_to(new_map, (4,) + new_map.shape)
+    weights = np.arange(1, 5, dtype=np.uint16)[:, np.newaxis, np.newaxis]
+    mixed = old_map.astype(np.uint16) * (4 - weights) + new_map.astype(np.uint16) * weights + 2
+    return (mixed >> 2).astype(np.uint8)
+
+
+class SaliencySource(object):
+    '''
+    uint8 saliency maps of the states of a stream, backed by a (memory-mapped) array
+    '''
+
+    def __init__(self, states, maps):
+        self.rows = {int(state): row for row, state in enumerate(states)}
+        self.maps = maps
+
+    def __contains__(self, state):
+        return state in self.rows
+
+    def __getitem__(self, state):
+        return np.asarray(self.maps[self.rows[state]])
+
+
+def read_saliency_source(stream_folder, workers=None, block_size=256):
+    '''
+    quantizes the raw_argmax maps of all states into stream_folder/raw_argmax_uint8.bin, maps of states that are
+    already in the file are not read again as long as their npy file did not change
+    :param stream_folder: folder of the stream
+    :param workers: number of threads used to load the npy files
+    :param block_size: number of npy files that are loaded at once
+    :return: SaliencySource with the maps of all states
+    '''
+    filename = os.path.join(stream_folder, SALIENCY_FILE)
+    state_files = list_state_files(os.path.join(stream_folder, 'raw_argmax'), '.npy')
+    metadata = {'scale': SALIENCY_SCALE, 'channel': SALIENCY_CHANNEL}
+    load = lambda name: quantize_saliency_map(np.load(name))
+    consolidate_state_files(filename, state_files, load, np.uint8, metadata, workers, block_size)
+    return open_saliency_source(stream_folder)
+
+
+def open_saliency_source(stream_folder):
+    '''
+    memory-maps the quantized maps written by read_saliency_source
+    :return: SaliencySource with the maps of all states in the file
+    '''
+    filename = os.path.join(stream_folder, SALIENCY_FILE)
+    if not os.path.exists(filename) or os.path.getsize(filename) == 0:
+        return SaliencySource([], None)
+    states, maps = read_state_array_file(filename, mmap=True)
+    return SaliencySource(states, maps)
@@ -0,0 +1,183 @@
+"""
+    Cache for the stages of get_key_states (importance, HIGHLIGHTS-DIV threshold and summaries).
+
+    Every entry is stored under a key that hashes everything the stage depends on: a manifest of its input files
+    (name, size and modification time) and its parameters. A changed stream or changed parameters therefore never reuse
+    a stale result, while stages whose inputs did not change (e.g. the importance when only the context changes) are
+    reused.
+
+    Stages that work per state also keep a manifest of the states they already processed (load_states/add_states),
+    and the latest result of a stage can be stored under the key 'latest', so a stream that grew by appending states
+    only needs the new states to be processed. Both only apply to the stream they were computed from: they are checked
+    against a fingerprint of the start of q_values.bin (prefix_fingerprint), which changes when the stream is generated
+    again in place.
+"""
+
+import hashlib
+import json
+import os
+import numpy as np
+from state_arrays import write_state_table, read_state_table
+
+CACHE_FOLDER = 'stage_cache'
+#every step of the rollout appends a record to this file, so it only grows while the stream is extended
+STREAM_FILE = 'q_values.bin'
+
+
+def path_manifest(path, extension=None):
+    '''
+    :param path: a file or a directory
+    :param extension: only list files with this extension if path is a directory
+    :return: sorted list of [name, size, modification time] of the file or of all files in the directory
+    '''
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return [[os.path.basename(path), stat.st_size, stat.st_mtime_ns]]
+    if not os.path.isdir(path):
+        return []
+    manifest = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file() and (extension is None or entry.name.endswith(extension)):
+                stat = entry.stat()
+                manifest.append([entry.name, stat.st_size, stat.st_mtime_ns])
+    manifest.sort()
+    return manifest
+
+
+def stage_key(*parts):
+    '''
+    :param parts: JSON serializable values the stage depends on (manifests, parameters, keys of earlier stages)
+    :return: hex digest identifying the combination
+    '''
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def prefix_fingerprint(filename, length=None):
+    '''
+    :param filename: a file that only grows by appending, e.g. stream/q_values.bin
+    :param length: number of bytes at the start of the file to fingerprint, None for the whole file
+    :return: [length, sha1 of these bytes], or None if the file does not exist
+    '''
+    if not os.path.exists(filename):
+        return None
+    if length is None:
+        length = os.path.getsize(filename)
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as prefix_file:
+        remaining = length
+        while remaining > 0:
+            block = prefix_file.read(min(remaining, 2**20))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+    return [length, digest.hexdigest()]
+
+
+def has_prefix(filename, fingerprint):
+    '''
+    :param fingerprint: prefix_fingerprint of the file at an earlier time
+    :return: True if the file still starts with the same bytes, i.e. it was at most appended to since then
+    '''
+    if fingerprint is None:
+        return not os.path.exists(filename)
+    return (os.path.exists(filename) and os.path.getsize(filename) >= fingerprint[0]
+            and prefix_fingerprint(filename, fingerprint[0]) == list(fingerprint))
+
+
+class StageCache(object):
+    '''
+    Stores the results of the stages in stream_folder/stage_cache, one file per stage and key.
+    '''
+
+    def __init__(self, stream_folder):
+        self.folder = os.path.join(stream_folder, CACHE_FOLDER)
+        self.stream_file = os.path.join(stream_folder, STREAM_FILE)
+
+    def path(self, stage, key, extension):
+        return os.path.join(self.folder, stage + '_' + key + extension)
+
+    def has(self, stage, key, extension='.json'):
+        return os.path.exists(self.path(stage, key, extension))
+
+    def load(self, stage, key):
+        '''
+        :return: the stored value, or None if there is no entry for the key
+        '''
+        if not self.has(stage, key):
+            return None
+        with open(self.path(stage, key, '.json'), 'r') as cache_file:
+            return json.load(cache_file)
+
+    def save(self, stage, key, value):
+        '''
+        :param value: JSON serializable value
+        '''
+        self._write(self.path(stage, key, '.json'), lambda filename: _dump_json(value, filename))
+
+    def load_table(self, stage, key, columns=None):
+        '''
+        :return: the stored dataframe (see state_arrays.read_state_table), or None if there is no entry for the key
+        '''
+        if not self.has(stage, key, '.parquet'):
+            return None
+        return read_state_table(self.path(stage, key, '.parquet'), columns=columns)
+
+    def save_table(self, stage, key, df):
+        self._write(self.path(stage, key, '.parquet'), lambda filename: write_state_table(df, filename))
+
+    def load_array(self, stage, key):
+        '''
+        :return: the stored numpy array, or None if there is no entry for the key
+        '''
+        if not self.has(stage, key, '.npy'):
+            return None
+        return np.load(self.path(stage, key, '.npy'))
+
+    def save_array(self, stage, key, array):
+        self._write(self.path(stage, key, '.npy'), lambda filename: _dump_array(array, filename))
+
+    def load_states(self, stage):
+        '''
+        :return: set of the states the stage already processed, empty if the stream was generated again since
+        '''
+        manifest = self.load(stage, 'states')
+        if manifest is None or not has_prefix(self.stream_file, manifest['stream']):
+            return set()
+        return set(manifest['states'])
+
+    def add_states(self, stage, states):
+        '''
+        adds states to the manifest of processed states of the stage
+        '''
+        processed = self.load_states(stage)
+        processed.update(int(state) for state in states)
+        self.save(stage, 'states', {'states': sorted(processed), 'stream': prefix_fingerprint(self.stream_file)})
+
+    def remove_states(self, stage, states):
+        '''
+        removes states from the manifest of processed states of the stage, e.g. because their results were overwritten
+        '''
+        processed = self.load_states(stage)
+        if processed.intersection(int(state) for state in states):
+            processed.difference_update(int(state) for state in states)
+            self.save(stage, 'states', {'states': sorted(processed), 'stream': prefix_fingerprint(self.stream_file)})
+
+    def _write(self, filename, write):
+        # write to a temporary file first, so an interrupted run never leaves a broken entry behind
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        temporary_filename = filename + '.tmp'
+        write(temporary_filename)
+        os.replace(temporary_filename, filename)
+
+
+def _dump_json(value, filename):
+    with open(filename, 'w') as cache_file:
+        json.dump(value, cache_file)
+
+
+def _dump_array(array, filename):
+    with open(filename, 'wb') as cache_file:
+        np.save(cache_file, array)
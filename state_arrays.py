@@ -0,0 +1,277 @@
+"""
+    Consolidated binary storage for arrays that exist once per state (Q-values, features).
+
+    A file starts with a header (magic string, header length and a JSON description of the row shape and dtype)
+    followed by fixed-size records of the form (state index, row). Records are appended while the stream is generated,
+    and the whole file is read back with a single np.fromfile (or memory-mapped with np.memmap).
+
+    Tables with one row per state (e.g. state_features_importance) are stored as Parquet, with array columns as
+    FixedSizeList<float32> columns that are read back into NumPy without copying (write_state_table/read_state_table).
+"""
+
+import json
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+MAGIC = b'HLSTATE1'
+HEADER_ALIGNMENT = 64
+
+
+def record_dtype(row_shape, dtype):
+    '''
+    :param row_shape: shape of the array stored for each state
+    :param dtype: dtype of the stored arrays
+    :return: the structured dtype of one record
+    '''
+    return np.dtype([('state', '<i8'), ('values', np.dtype(dtype).newbyteorder('<'), tuple(row_shape))])
+
+
+def read_header(filename):
+    '''
+    reads the header of a state array file
+    :param filename: path of the file
+    :return: row shape, dtype, the offset at which the records start and a dict with the remaining header entries
+    '''
+    with open(filename, 'rb') as state_file:
+        prefix = state_file.read(len(MAGIC) + 4)
+        if len(prefix) < len(MAGIC) + 4 or prefix[:len(MAGIC)] != MAGIC:
+            raise ValueError(filename + ' is not a state array file')
+        header_length = struct.unpack('<I', prefix[len(MAGIC):])[0]
+        header = json.loads(state_file.read(header_length).decode('ascii'))
+    row_shape = tuple(header.pop('shape'))
+    dtype = np.dtype(header.pop('dtype'))
+    return row_shape, dtype, len(prefix) + header_length, header
+
+
+def write_header(state_file, row_shape, dtype, metadata=None):
+    header = dict(metadata or {})
+    header.update({'shape': list(row_shape), 'dtype': np.dtype(dtype).str})
+    header = json.dumps(header).encode('ascii')
+    # pad with spaces so the records start at an aligned offset
+    header_length = len(MAGIC) + 4 + len(header)
+    header += b' ' * (-header_length % HEADER_ALIGNMENT)
+    state_file.write(MAGIC + struct.pack('<I', len(header)) + header)
+
+
+class StateArrayWriter(object):
+    '''
+    Appends one row per state to a state array file.
+    The row shape is taken from the first array if it is not given. Opening an existing file in append mode checks
+    that its header matches and continues after the last complete record.
+    metadata is an optional dict of JSON values stored in the header, e.g. the scale of quantized values.
+    '''
+
+    def __init__(self, filename, row_shape=None, dtype=np.float32, mode='w', metadata=None):
+        directory = os.path.dirname(filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.filename = filename
+        self.dtype = np.dtype(dtype)
+        self.row_shape = None if row_shape is None else tuple(row_shape)
+        self.metadata = metadata
+        self.record = None
+        self.file = None
+        if mode == 'a' and os.path.exists(filename) and os.path.getsize(filename) > 0:
+            existing_shape, existing_dtype, offset, self.metadata = read_header(filename)
+            if self.row_shape is not None and self.row_shape != existing_shape:
+                raise ValueError('row shape ' + str(self.row_shape) + ' does not match ' + str(existing_shape) +
+                                 ' in ' + filename)
+            self.row_shape = existing_shape
+            self.dtype = existing_dtype
+            self.record = np.zeros((), dtype=record_dtype(self.row_shape, self.dtype))
+            self.file = open(filename, 'r+b')
+            # drop a partially written last record
+            complete = (os.path.getsize(filename) - offset) // self.record.itemsize
+            self.file.truncate(offset + complete * self.record.itemsize)
+            self.file.seek(0, os.SEEK_END)
+        elif mode in ('w', 'a'):
+            self.file = open(filename, 'wb')
+        else:
+            raise ValueError('mode has to be "w" or "a"')
+
+    def append(self, state, array):
+        '''
+        :param state: index of the state
+        :param array: array of the state, squeezed to the row shape
+        '''
+        if self.record is None:
+            if self.row_shape is None:
+                self.row_shape = np.squeeze(array).shape
+            self.record = np.zeros((), dtype=record_dtype(self.row_shape, self.dtype))
+            write_header(self.file, self.row_shape, self.dtype, self.metadata)
+        self.record['state'] = state
+        self.record['values'] = np.reshape(array, self.row_shape)
+        self.file.write(self.record.tobytes())
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_state_array_file(filename, mmap=False):
+    '''
+    reads all complete records of a state array file
+    :param filename: path of the file
+    :param mmap: if True the values are memory-mapped instead of read into memory
+    :return: array with the state indices and array with one row per state, (number of states,) + row shape
+    '''
+    row_shape, dtype, offset, _ = read_header(filename)
+    record = record_dtype(row_shape, dtype)
+    count = (os.path.getsize(filename) - offset) // record.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros((0,) + row_shape, dtype=dtype)
+    if mmap:
+        records = np.memmap(filename, dtype=record, mode='r', offset=offset, shape=(count,))
+        return np.array(records['state']), records['values']
+    records = np.fromfile(filename, dtype=record, count=count, offset=offset)
+    return records['state'], np.ascontiguousarray(records['values'])
+
+
+def records_end(filename, count):
+    '''
+    :return: the offset in bytes after the first count records of a state array file
+    '''
+    row_shape, dtype, offset, _ = read_header(filename)
+    return offset + count * record_dtype(row_shape, dtype).itemsize
+
+
+def state_array_filename(path):
+    '''
+    :param path: per-state directory of a stream, e.g. stream/q_values
+    :return: the consolidated file that replaces that directory, e.g. stream/q_values.bin
+    '''
+    return os.path.normpath(path) + '.bin'
+
+
+def file_signature(filename):
+    '''
+    :return: [size, modification time in ns] of a file, they change when the file is written again
+    '''
+    stat = os.stat(filename)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def sources_filename(filename):
+    '''
+    :param filename: state array file consolidated from per state files
+    :return: the JSON file with the file_signature of the per state file of each of its records
+    '''
+    return filename + '.sources.json'
+
+
+def consolidate_state_files(filename, state_files, load, dtype, metadata=None, workers=None, block_size=256):
+    '''
+    adds the arrays of per state files (e.g. stream/state/*.npy) to a state array file. Files of states that are
+    already in it are not read again, unless a file changed or was removed since its record was written (e.g. the
+    stream was generated again in place), then the whole file is written again.
+    :param filename: path of the state array file
+    :param state_files: list of (state index, file path) tuples sorted by state index
+    :param load: function file path -> array of the state, called from worker threads
+    :param dtype: dtype of the stored arrays
+    :param metadata: header entries of the state array file
+    :param workers: number of threads used to load the files
+    :param block_size: number of files that are loaded at once
+    '''
+    signatures = {str(state): file_signature(name) for state, name in state_files}
+    mode = 'w'
+    known_states = set()
+    if os.path.exists(filename) and os.path.getsize(filename) > 0 and os.path.exists(sources_filename(filename)):
+        with open(sources_filename(filename), 'r') as sources_file:
+            recorded = json.load(sources_file)
+        known_states = set(read_state_array_file(filename, mmap=True)[0].tolist())
+        if all(signatures.get(str(state)) == recorded.get(str(state)) for state in known_states):
+            mode = 'a'
+        else:
+            known_states = set()
+    new_files = [(state, name) for state, name in state_files if state not in known_states]
+    if mode == 'a' and not new_files:
+        return
+    with StateArrayWriter(filename, dtype=dtype, mode=mode, metadata=metadata) as writer, \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, len(new_files), block_size):
+            block = new_files[start:start + block_size]
+            for (state, _), array in zip(block, executor.map(load, [name for _, name in block])):
+                writer.append(state, array)
+    # written after the records, records without a matching signature make the next call write the file again
+    temporary_filename = sources_filename(filename) + '.tmp'
+    with open(temporary_filename, 'w') as sources_file:
+        json.dump(signatures, sources_file)
+    os.replace(temporary_filename, sources_filename(filename))
+
+
+def array_column(arrays, dtype=np.float32):
+    '''
+    :param arrays: sequence of equally long arrays or a 2D array
+    :param dtype: dtype of the list values
+    :return: FixedSizeListArray with one list per array
+    '''
+    if isinstance(arrays, np.ndarray) and arrays.dtype != object:
+        matrix = arrays
+    else:
+        matrix = np.stack([np.ravel(array) for array in arrays]) if len(arrays) > 0 else np.zeros((0, 0))
+    matrix = np.ascontiguousarray(matrix.reshape(len(matrix), -1), dtype=dtype)
+    return pa.FixedSizeListArray.from_arrays(pa.array(matrix.ravel()), matrix.shape[1])
+
+
+def is_array_column(values):
+    return values.dtype == object and len(values) > 0 and isinstance(values[0], np.ndarray)
+
+
+def write_state_table(df, filename):
+    '''
+    saves a dataframe with one row per state as Parquet, columns that hold numpy arrays become FixedSizeList columns
+    :param df: the dataframe
+    :param filename: path of the Parquet file
+    '''
+    columns = {}
+    for name in df.columns:
+        values = df[name].values
+        if is_array_column(values):
+            columns[name] = array_column(values)
+        else:
+            columns[name] = pa.array(values)
+    pq.write_table(pa.table(columns), filename)
+
+
+def column_matrix(column):
+    '''
+    :param column: FixedSizeList column of a table
+    :return: (number of rows, list size) numpy array, sharing memory with the column where possible
+    '''
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks() if column.num_chunks != 1 else column.chunk(0)
+    values = column.flatten().to_numpy(zero_copy_only=False)
+    return values.reshape(len(column), column.type.list_size)
+
+
+def read_state_table(filename, columns=None):
+    '''
+    loads a table saved with write_state_table
+    :param filename: path of the Parquet file
+    :param columns: list of columns to read, e.g. ['state', 'importance'], None reads all of them
+    :return: dataframe, array columns hold one row view of the column matrix per state
+    '''
+    table = pq.read_table(filename, columns=columns)
+    data = {}
+    for name in table.column_names:
+        column = table.column(name)
+        if pa.types.is_fixed_size_list(column.type):
+            data[name] = list(column_matrix(column))
+        else:
+            data[name] = column.to_numpy()
+    return pd.DataFrame(data, columns=table.column_names)
@@ -1,8 +1,8 @@
 """
     Generates a stream of gameplay for a given agent.
 
-    A folder 'stream' is created whose subfolders contain all the states, visually displayed frames, Q-values,
-    saliency maps and features (output of the second to last layer).
+    A folder 'stream' is created whose subfolders contain all the states, visually displayed frames and saliency maps.
+    Q-values and features (output of the second to last layer) are stored in q_values.bin and features.bin.
 
     At the very end *overlay_stream* is used to overlay each frame with a saliency map.
     This can also be redone later using *overlay_stream* to save time while trying different overlay styles.
@@ -29,6 +29,10 @@ import seaborn as sns
 #import h5py
 import coloredlogs, logging
 from tracker import Tracker
+from ram_tracker import RamTracker
+from state_arrays import StateArrayWriter, state_array_filename, read_state_array_file
+from summary_preview import SummaryPreview
+from image_utils import save_frame
 
 #Quickfix for argmax
 import os
@@ -37,26 +41,12 @@ os.environ["CUDA_VISIBLE_DEVICES"]="-1"
 def vis_testing(stats_df, directory):
     print("Notebooks")
 
-def save_frame(array, save_file, frame):
-    if not (os.path.isdir(save_file)):
-        os.makedirs(save_file)
-        os.rmdir(save_file)
-    plt.imsave(save_file + '_' + str(frame) + '.png', array)
-
 def save_array(array, save_file, frame):
     if not (os.path.isdir(save_file)):
         os.makedirs(save_file)
         os.rmdir(save_file)
     np.save(save_file + '_' + str(frame) + '.npy', array)
 
-def save_q_values(array, save_file, frame):
-    if not (os.path.isdir(save_file)):
-        os.makedirs(save_file)
-        os.rmdir(save_file)
-    save_file = save_file + '_' + str(frame) + '.txt'
-    with open(save_file, "w") as text_file:
-        text_file.write(str(array))
-
 def save_raw_data(array,save_file, frame):
     '''
     saves a raw state or saliency map as array and as image
@@ -97,6 +87,18 @@ def get_feature_vector(model, input):
     features = np.squeeze(features)
     return features
     
+def next_stream_state(directory):
+    '''
+    :param directory: folder of a stream
+    :return: the index the next saved state of the stream gets, 0 for a new stream
+    '''
+    q_values_filename = state_array_filename(os.path.join(directory, 'q_values'))
+    if not os.path.exists(q_values_filename) or os.path.getsize(q_values_filename) == 0:
+        return 0
+    states, _ = read_state_array_file(q_values_filename, mmap=True)
+    return int(states.max()) + 1 if len(states) > 0 else 0
+
+
 def generate_stream(args):
     logger = logging.getLogger()
     coloredlogs.install(level='DEBUG', fmt='%(asctime)s,%(msecs)03d %(filename)s[%(process)d] %(levelname)s %(message)s')
@@ -160,6 +162,13 @@ def generate_stream(args):
             logger.info(action_episode_sums)
     
     env = AltRewardsWrapper(env)
+    # one tracker per environment, it keeps the characters and the background model between the steps
+    if args.tracker == 'ram':
+        image_peeler = RamTracker()
+    else:
+        image_peeler = Tracker(debug_every=args.tracker_debug_every)
+    # the screen offsets of the RAM tracker are checked on the first frame that shows a character
+    offsets_checked = args.tracker != 'ram'
     env.reset()
     wrapper = atari_wrapper(env)
     wrapper.reset(noop_max=1)
@@ -172,9 +181,20 @@ def generate_stream(args):
     save_file_argmax_raw = os.path.join(directory, 'raw_argmax', 'raw_argmax')
     save_file_screen = os.path.join(directory, 'screen', 'screen')
     save_file_state = os.path.join(directory, 'state', 'state')
-    save_file_q_values = os.path.join(directory, 'q_values', 'q_values')
     save_file_q_value_numpys = os.path.join(directory, 'q_value_numpys', 'q_value_numpys')
-    save_file_features = os.path.join(directory, 'features', 'features')
+    # Q-values and features are appended as float32 rows to one binary file each (see state_arrays)
+    # when extending a stream the new states continue its numbering (the first 4 steps are not saved) and are appended
+    # to its files, so the later stages only have to process the new states
+    state_offset = 0
+    writer_mode = 'w'
+    if args.extend_stream:
+        first_state = next_stream_state(directory)
+        state_offset = first_state - 4 if first_state > 0 else 0
+        writer_mode = 'a'
+        if args.verbose:
+            logger.info("Extending the stream, the first new state is " + str(state_offset + 4))
+    q_value_writer = StateArrayWriter(state_array_filename(os.path.join(directory, 'q_values')), mode=writer_mode)
+    feature_writer = StateArrayWriter(state_array_filename(os.path.join(directory, 'features')), mode=writer_mode)
     scores_file = os.path.join(directory, 'scores.txt')
     if args.verbose:
         logger.info("Made scores file")
@@ -184,99 +204,118 @@ def generate_stream(args):
         logger.info(df_file)
     average_score_file = os.path.join(directory, 'average_score.txt')
 
-    for _ in range(steps):
-        if _ < 4:
-            action = env.action_space.sample()
-#            print("Now trying to take an action and it is: " + str(action))
-#            while (action == 0 or action > 4):
-#                action = env.action_space.sample()
-#                print("Now action is: " + str(action))
-            if args.verbose:
-                logger.info("Now officially taking action " + str(action))
-            # to have more controll over the fixed starts
-            if fixed_start:
-                action=0
-            output = [0]
-            features = [0]
-            argmax = 0
-            my_input = [0]
-        else:
-            my_input = np.expand_dims(stacked_frames, axis=0)
-#            logger.info("first input: ")
-#            logger.info(my_input)
-#            logger.info("squeezed input")
-#            logger.debug(np.squeeze(my_input))
+    # the writers and the preview process are closed even if the rollout fails
+    preview = None
+    try:
+        # renders a provisional summary in the background while the rollout is running (see summary_preview)
+        preview = SummaryPreview(args, [q_value_writer, feature_writer]) if args.preview else None
+        for _ in range(steps):
+            state = _ + state_offset
+            if _ < 4:
+                action = env.action_space.sample()
+    #            print("Now trying to take an action and it is: " + str(action))
+    #            while (action == 0 or action > 4):
+    #                action = env.action_space.sample()
+    #                print("Now action is: " + str(action))
+                if args.verbose:
+                    logger.info("Now officially taking action " + str(action))
+                # to have more controll over the fixed starts
+                if fixed_start:
+                    action=0
+                output = [0]
+                features = [0]
+                argmax = 0
+                my_input = [0]
+            else:
+                my_input = np.expand_dims(stacked_frames, axis=0)
+    #            logger.info("first input: ")
+    #            logger.info(my_input)
+    #            logger.info("squeezed input")
+    #            logger.debug(np.squeeze(my_input))
             
-            if args.verbose:
-                logger.info("MY_INPUT is: " + str(my_input))
-            output = model.predict(my_input, verbose = 0)  #this output corresponds with the output in baseline if --dueling=False is correctly set for baselines.
-            # save model predictions
-            save_q_values(output, save_file_q_values, _)
-            #save_array(output, save_file_q_value_numpys, _)
-            features = get_feature_vector(model, my_input)
-            save_q_values(features,save_file_features,_)
-            save_array(features, save_file_features,_)
+                if args.verbose:
+                    logger.info("MY_INPUT is: " + str(my_input))
+                output = model.predict(my_input, verbose = 0)  #this output corresponds with the output in baseline if --dueling=False is correctly set for baselines.
+                # save model predictions
+                q_value_writer.append(state, output)
+                #save_array(output, save_file_q_value_numpys, _)
+                features = get_feature_vector(model, my_input)
+                feature_writer.append(state, features)
 
-            action = np.argmax(np.squeeze(output))
+                action = np.argmax(np.squeeze(output))
 
-#            while (action == 0 or action > 4):
-#                action = env.action_space.sample()
-#                print("Now action is: " + str(action))
-            if args.verbose:
-                logger.info("Now officially taking action " + str(action))
+    #            while (action == 0 or action > 4):
+    #                action = env.action_space.sample()
+    #                print("Now action is: " + str(action))
+                if args.verbose:
+                    logger.info("Now officially taking action " + str(action))
 
-            #analyzing
-            argmax = analyzer_arg.analyze(my_input)
-            argmax = np.squeeze(argmax)
-            # save raw saliency
-            save_raw_data(argmax, save_file_argmax_raw, _)
+                #analyzing
+                argmax = analyzer_arg.analyze(my_input)
+                argmax = np.squeeze(argmax)
+                # save raw saliency
+                save_raw_data(argmax, save_file_argmax_raw, state)
 
-            #save the state
-            save_raw_data(my_input,save_file_state, _)
+                #save the state
+                save_raw_data(my_input,save_file_state, state)
 
-            #save screen output, and screen + saliency
-            for i in range(len(observations)):
-                index = str(_) + '_' + str(i)
-                observation = observations[i]
+                #save screen output, and screen + saliency
+                for i in range(len(observations)):
+                    index = str(state) + '_' + str(i)
+                    observation = observations[i]
+                    if args.verbose:
+                        logger.info("Obs is: ")
+                        logger.info(observation)
+                    save_frame(observation, save_file_screen, index)
+                # Let's see if we can use the stacked frame to get a position
                 if args.verbose:
-                    logger.info("Obs is: ")
-                    logger.info(observation)
-                save_frame(observation, save_file_screen, index)
-            # Let's see if we can use the stacked frame to get a position
-            imagePeeler = Tracker()
-            print("About to seek pacman")
-            characters, bg_locs = imagePeeler.wheresPacman(observation)
+                    logger.info("About to seek pacman")
+                if args.tracker == 'ram':
+                    ram = env.unwrapped.ale.getRAM()
+                    if not offsets_checked:
+                        offsets_checked = image_peeler.check_offsets(ram, observation) is not None
+                    characters, bg_locs = image_peeler.wheresPacman(ram, observation)
+                else:
+                    characters, bg_locs = image_peeler.wheresPacman(observation)
     
-        stacked_frames, observations, reward, done, info = wrapper.step(action)
+            stacked_frames, observations, reward, done, info = wrapper.step(action)
         
-        total_reward = total_reward + reward
-        mean_reward = (sum(reward_list) + total_reward)/step
-        if (args.verbose):
-            logger.info("Step " + str(step) + " out of " + str(args.num_steps))
-        step = step + 1
-#        ram = env.unwrapped._get_ram()
-#        if args.verbose:
-#            logger.info("Action is: ")
-#            logger.info(action_names[action])
-#            logger.info("RAM is: ")
-#            logger.info(ram)
-#        rv.store_ram_info(action, ram)
-        # only collect data after the first four steps
-        if _ >= 4:
-            # Add call here to update Pandas dataframe and output info for analysis
-            lives = env.ale.lives()
-            action_episode_sums, action_total_sums, pill_eaten = dv.store_data(action, action_names[action], action_episode_sums, action_total_sums, reward, done, lives, mean_reward, characters, bg_locs, pill_eaten)
-#            dv.store_arrays(output, argmax, observations)
+            total_reward = total_reward + reward
+            mean_reward = (sum(reward_list) + total_reward)/step
+            if (args.verbose):
+                logger.info("Step " + str(step) + " out of " + str(args.num_steps))
+            step = step + 1
+    #        ram = env.unwrapped._get_ram()
+    #        if args.verbose:
+    #            logger.info("Action is: ")
+    #            logger.info(action_names[action])
+    #            logger.info("RAM is: ")
+    #            logger.info(ram)
+    #        rv.store_ram_info(action, ram)
+            # only collect data after the first four steps
+            if _ >= 4:
+                # Add call here to update Pandas dataframe and output info for analysis
+                lives = env.ale.lives()
+                action_episode_sums, action_total_sums, pill_eaten = dv.store_data(action, action_names[action], action_episode_sums, action_total_sums, reward, done, lives, mean_reward, characters, bg_locs, pill_eaten)
+    #            dv.store_arrays(output, argmax, observations)
     
-        if done:
-            if args.verbose:
-                logger.info('total_reward',total_reward)
-            reward_list.append(total_reward)
+            if done:
+                if args.verbose:
+                    logger.info('total_reward',total_reward)
+                reward_list.append(total_reward)
             
-            total_reward = 0
+                total_reward = 0
             
-        if (args.watch_agent):
-            env.render()
+            if (args.watch_agent):
+                env.render()
+
+            if preview is not None and _ >= 4:
+                preview.update(state)
+    finally:
+        if preview is not None:
+            preview.close()
+        q_value_writer.close()
+        feature_writer.close()
 
     reward_list.append(total_reward)
     average_reward = np.mean(reward_list)
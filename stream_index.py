@@ -0,0 +1,153 @@
+"""
+    Index of the per state files of a stream (screen/screen_<state>_<frame>.png, raw_argmax/raw_argmax_<state>.npy, ...).
+
+    Every artifact folder is scanned once and the resulting state -> frames -> file name map is stored in
+    stream_folder/stage_cache. The stored index is reused as long as the modification time of the folder did not change,
+    so consumers no longer list and parse whole directories, but look up (O(1)) and iterate only the states they need.
+"""
+
+import bisect
+import json
+import os
+import re
+import time
+from stage_cache import CACHE_FOLDER
+
+#file name prefix of the artifacts in each folder of a stream, folders that are not listed accept any prefix
+ARTIFACT_PREFIXES = {'screen': 'screen', 'screen_smooth': 'screen', 'argmax_smooth': 'argmax', 'blur_argmax': 'argmax',
+                     'argmax': 'argmax', 'raw_argmax': 'raw_argmax', 'state': 'state', 'q_values': 'q_values',
+                     'features': 'features'}
+
+#a folder that changed less than this before it was scanned may change again without a new modification time
+MTIME_GRANULARITY_NS = 2 * 10**9
+
+FILE_PATTERN = re.compile(r'^(.*?)_(\d+)(?:_(\d+))?\.\w+$')
+
+
+def parse_filename(filename):
+    '''
+    :param filename: name like screen_12_3.png or raw_argmax_12.npy
+    :return: prefix, state index and frame index (None for files without frames), or None if the name does not match
+    '''
+    match = FILE_PATTERN.match(filename)
+    if match is None:
+        return None
+    frame = match.group(3)
+    return match.group(1), int(match.group(2)), None if frame is None else int(frame)
+
+
+class ArtifactIndex(object):
+    '''
+    The files of one artifact folder, by state and frame.
+    '''
+
+    def __init__(self, folder, entries):
+        '''
+        :param folder: path of the artifact folder
+        :param entries: list of (state, frame, file name), frame is None for files without frames
+        '''
+        self.folder = folder
+        self.state_frames = {}
+        for state, frame, filename in entries:
+            self.state_frames.setdefault(state, []).append((-1 if frame is None else frame, filename))
+        for frames in self.state_frames.values():
+            frames.sort()
+        self.states = sorted(self.state_frames)
+
+    def __contains__(self, state):
+        return state in self.state_frames
+
+    def __len__(self):
+        return len(self.states)
+
+    def path(self, filename):
+        return os.path.join(self.folder, filename)
+
+    def states_in_range(self, start, stop):
+        '''
+        :return: sorted list of the states start <= state < stop that have files
+        '''
+        return self.states[bisect.bisect_left(self.states, start):bisect.bisect_left(self.states, stop)]
+
+    def frames(self, states=None):
+        '''
+        :param states: states to iterate, in any order and possibly with repeats, None for all states
+        :return: generator of (state, frame, file name) sorted by state and frame, frame is None for files without frames
+        '''
+        if states is None:
+            states = self.states
+        else:
+            states = sorted(set(int(state) for state in states if int(state) in self.state_frames))
+        for state in states:
+            for frame, filename in self.state_frames[state]:
+                yield state, None if frame < 0 else frame, filename
+
+
+class StreamIndex(object):
+    '''
+    Lazily built, persistent indices of the artifact folders of a stream.
+    '''
+
+    def __init__(self, stream_folder):
+        self.stream_folder = stream_folder
+        self.artifacts = {}
+
+    def artifact(self, name, refresh=False):
+        '''
+        :param name: folder of the artifact in the stream, e.g. 'screen'
+        :param refresh: if True the folder is scanned again
+        :return: ArtifactIndex of the folder
+        '''
+        if refresh or name not in self.artifacts:
+            self.artifacts[name] = self._load(name, refresh)
+        return self.artifacts[name]
+
+    def _index_filename(self, name):
+        return os.path.join(self.stream_folder, CACHE_FOLDER, 'index_' + name + '.json')
+
+    def _load(self, name, refresh):
+        folder = os.path.join(self.stream_folder, name)
+        if not os.path.isdir(folder):
+            return ArtifactIndex(folder, [])
+        mtime = os.stat(folder).st_mtime_ns
+        index_filename = self._index_filename(name)
+        if not refresh and os.path.exists(index_filename):
+            with open(index_filename, 'r') as index_file:
+                stored = json.load(index_file)
+            if stored['mtime'] == mtime:
+                return ArtifactIndex(folder, stored['entries'])
+        scanned_at = time.time_ns()
+        entries = scan_folder(folder, ARTIFACT_PREFIXES.get(name))
+        if scanned_at - mtime > MTIME_GRANULARITY_NS:
+            if not os.path.isdir(os.path.dirname(index_filename)):
+                os.makedirs(os.path.dirname(index_filename))
+            temporary_filename = index_filename + '.tmp'
+            with open(temporary_filename, 'w') as index_file:
+                json.dump({'mtime': mtime, 'entries': entries}, index_file)
+            os.replace(temporary_filename, index_filename)
+        return ArtifactIndex(folder, entries)
+
+
+def scan_folder(folder, prefix=None):
+    '''
+    :param folder: artifact folder
+    :param prefix: only files with this prefix are indexed, None indexes all files
+    :return: list of (state, frame, file name) of the files in the folder
+    '''
+    entries = []
+    with os.scandir(folder) as folder_entries:
+        for entry in folder_entries:
+            parsed = parse_filename(entry.name)
+            if parsed is None or (prefix is not None and parsed[0] != prefix):
+                continue
+            entries.append((parsed[1], parsed[2], entry.name))
+    return entries
+
+
+def folder_index(folder):
+    '''
+    :param folder: an artifact folder of a stream, e.g. stream/screen_smooth/
+    :return: ArtifactIndex of the folder
+    '''
+    folder = os.path.normpath(folder)
+    return StreamIndex(os.path.dirname(folder)).artifact(os.path.basename(folder))
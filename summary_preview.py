@@ -0,0 +1,271 @@
+"""
+    Progressive preview of the HIGHLIGHTS-DIV summary while generate_stream is running.
+
+    Every --preview-interval seconds the rollout flushes its q_values and features files (see state_arrays) and tells
+    a background process up to which state the stream is complete. The process computes the summary of these states
+    with the same get_key_states as the final summary, renders only the trajectories that are new in the summary into
+    one video segment each (the green overlay, straight from the screens and saliency maps) and joins the segments of
+    the current summary into stream_folder/preview/preview.mp4. After every round the process sleeps long enough to
+    stay within --preview-cpu-share of one core, so the rollout is not slowed down beyond that.
+
+    The process runs this file as a script, so it only imports the modules it needs (no tensorflow, keras or gym, and
+    not the module that started the rollout). The args and the requests are sent pickled through its stdin.
+"""
+
+import coloredlogs, logging
+import os
+import pickle
+import queue
+import subprocess
+import sys
+import threading
+import time
+import cv2
+import frame_cache
+import image_utils
+import overlay_rendering
+from state_arrays import state_array_filename
+from stream_index import StreamIndex
+from video_generation import get_key_states, SUMMARY_FEATURES
+
+PREVIEW_FOLDER = 'preview'
+PREVIEW_VIDEO = 'preview.mp4'
+#overlay style of the preview, see overlay_rendering.STYLE_FOLDERS
+PREVIEW_STYLE = 'green'
+#threads of the ffmpeg encoder of the preview, so it stays within the CPU share as well
+PREVIEW_ENCODER_THREADS = 1
+
+
+class SummaryPreview(object):
+    '''
+    Handle of the preview process, owned by generate_stream.
+    '''
+
+    def __init__(self, args, writers=()):
+        '''
+        :param writers: state_arrays.StateArrayWriter of the q values and features, flushed before every preview round
+        '''
+        self.interval = args.preview_interval
+        self.writers = writers
+        self.last_request = time.time()
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__)], stdin=subprocess.PIPE)
+        self.send(args)
+
+    def send(self, message):
+        pickle.dump(message, self.process.stdin)
+        self.process.stdin.flush()
+
+    def update(self, last_state):
+        '''
+        called after every step of the rollout, requests a preview round every interval seconds
+        :param last_state: the last state whose files are all written
+        '''
+        if self.process is None or time.time() - self.last_request < self.interval:
+            return
+        self.last_request = time.time()
+        for writer in self.writers:
+            writer.flush()
+        try:
+            self.send(last_state)
+        except OSError as e:
+            logging.getLogger().error("The preview process stopped: " + str(e))
+            self.process = None
+
+    def close(self, timeout=10):
+        '''
+        stops the preview process, a round that does not finish within timeout seconds is aborted
+        '''
+        if self.process is None:
+            return
+        try:
+            self.send(None)
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.terminate()
+            self.process.wait()
+
+
+def read_requests(stream, requests):
+    '''
+    puts the pickled requests of stream into the queue until it gets None or the stream is closed
+    '''
+    while True:
+        try:
+            request = pickle.load(stream)
+        except EOFError:
+            request = None
+        requests.put(request)
+        if request is None:
+            return
+
+
+def preview_service(args, requests):
+    '''
+    main loop of the preview process, runs a preview round for the latest request until it gets None
+    :param requests: queue with the last complete state of the stream
+    '''
+    logger = logging.getLogger()
+    coloredlogs.install(level='DEBUG', fmt='%(asctime)s,%(msecs)03d %(filename)s[%(process)d] %(levelname)s %(message)s')
+    if hasattr(os, 'nice'):
+        os.nice(10)
+    cv2.setNumThreads(1)
+    # the preview process starts with the default size of the frame cache
+    frame_cache.configure(args.frame_cache_mb * 2**20)
+    preview = PreviewRenderer(args)
+    share = min(max(args.preview_cpu_share, 0.01), 1.0)
+    while True:
+        last_state = requests.get()
+        # rounds are slower than the requests, only the latest one matters
+        while last_state is not None and not requests.empty():
+            last_state = requests.get()
+        if last_state is None:
+            return
+        started = time.time()
+        try:
+            preview.update(last_state)
+        except Exception as e:
+            logger.error("Preview of state " + str(last_state) + " failed: " + str(e))
+        time.sleep((time.time() - started) * (1 / share - 1))
+
+
+def provisional_summary(args, stream_folder):
+    '''
+    HIGHLIGHTS-DIV summary of the states written so far, computed by get_key_states like the final summary. Its stages
+    are cached (see stage_cache), so the final get_key_states reuses the consolidated inputs and the importance.
+    :return: list of the summary states including their context
+    '''
+    if not os.path.exists(state_array_filename(os.path.join(stream_folder, 'q_values'))):
+        return []
+    return [int(state) for state in get_key_states(args, stream_folder, features=SUMMARY_FEATURES)]
+
+
+def trajectories(states):
+    '''
+    :param states: summary states
+    :return: list of tuples with the successive states of each trajectory of the summary, sorted
+    '''
+    runs = []
+    for state in sorted(set(states)):
+        if runs and state == runs[-1][-1] + 1:
+            runs[-1].append(state)
+        else:
+            runs.append([state])
+    return [tuple(run) for run in runs]
+
+
+class PreviewRenderer(object):
+    '''
+    Renders the trajectories of the provisional summaries into video segments and joins the current ones.
+    '''
+
+    def __init__(self, args):
+        self.args = args
+        self.stream_folder = args.stream_folder
+        self.preview_folder = os.path.join(self.stream_folder, PREVIEW_FOLDER)
+        if not os.path.isdir(self.preview_folder):
+            os.makedirs(self.preview_folder)
+        self.encoder_options = dict(image_utils.video_encoder_options(args), threads=PREVIEW_ENCODER_THREADS)
+        self.concat = image_utils.segment_encoding_supported(args)
+        # trajectory -> file name of its segment
+        self.segments = {}
+        self.black_segment = None
+
+    def update(self, last_state):
+        '''
+        one preview round over the states up to last_state
+        '''
+        logger = logging.getLogger()
+        summary = [state for state in provisional_summary(self.args, self.stream_folder) if state <= last_state]
+        current = trajectories(summary)
+        new = [trajectory for trajectory in current if trajectory not in self.segments]
+        if not new and len(current) == len(self.segments):
+            return
+        screens = StreamIndex(self.stream_folder).artifact('screen', refresh=True)
+        for trajectory in new:
+            self.segments[trajectory] = self.render_trajectory(screens, trajectory)
+        for trajectory in [trajectory for trajectory in self.segments if trajectory not in current]:
+            os.remove(self.segments.pop(trajectory))
+        self.write_preview(current)
+        if self.args.verbose:
+            logger.info("Preview of " + str(len(current)) + " trajectories up to state " + str(last_state) + ", "
+                        + str(len(new)) + " new")
+
+    def segment_filename(self, name):
+        return os.path.join(self.preview_folder, name + '.mp4')
+
+    def render_trajectory(self, screens, trajectory):
+        '''
+        renders the green overlay of the frames of a trajectory into its own video segment
+        :param screens: stream_index.ArtifactIndex of the screens
+        :return: file name of the segment
+        '''
+        filename = self.segment_filename('segment_' + str(trajectory[0]) + '_' + str(trajectory[-1]))
+        images = [image for _, _, image in screens.frames(trajectory)]
+        # the smoothing and interpolation start from the last frame before the trajectory, like in overlay_segments
+        previous = [image for _, frame, image in screens.frames([trajectory[0] - 1]) if frame == 3]
+        video = image_utils.SummaryVideoWriter(filename, states=trajectory, encoder_options=self.encoder_options)
+        overlay_rendering.overlay_frames(self.args, self.stream_folder, images, set(trajectory),
+                                         previous_image=previous[0] if previous else None,
+                                         videos={overlay_rendering.STYLE_FOLDERS[PREVIEW_STYLE]: [video]},
+                                         save_frames=False, styles=[PREVIEW_STYLE])
+        video.close()
+        return filename
+
+    def write_preview(self, current):
+        '''
+        joins the segments of the current trajectories, separated by black frames, and replaces the preview video
+        '''
+        filename = os.path.join(self.preview_folder, PREVIEW_VIDEO)
+        temporary_filename = os.path.join(self.preview_folder, 'preview.tmp.mp4')
+        segments = [self.segments[trajectory] for trajectory in current]
+        if not segments:
+            return
+        if self.concat:
+            if self.black_segment is None:
+                self.black_segment = self.segment_filename('black')
+                video = image_utils.SummaryVideoWriter(self.black_segment, encoder_options=self.encoder_options)
+                video.write_black_frames()
+                video.close()
+            joined = []
+            for segment in segments:
+                joined.extend([self.black_segment, segment] if joined else [segment])
+            image_utils.concat_videos(joined, temporary_filename, remove_segments=False)
+        else:
+            copy_segments(segments, temporary_filename, self.encoder_options)
+        os.replace(temporary_filename, filename)
+
+
+def copy_segments(segments, filename, encoder_options):
+    '''
+    joins video segments by decoding and encoding them again, for when ffmpeg is missing
+    '''
+    video = image_utils.SummaryVideoWriter(filename, encoder_options=encoder_options)
+    for number, segment in enumerate(segments):
+        if number > 0:
+            video.write_black_frames()
+        capture = cv2.VideoCapture(segment)
+        while True:
+            success, frame = capture.read()
+            if not success:
+                break
+            video.video.write(frame)
+        capture.release()
+    video.close()
+
+
+def main():
+    '''
+    entry point of the preview process, reads the pickled args and then the requests from stdin
+    '''
+    args = pickle.load(sys.stdin.buffer)
+    requests = queue.Queue()
+    threading.Thread(target=read_requests, args=(sys.stdin.buffer, requests), daemon=True).start()
+    preview_service(args, requests)
+
+
+if __name__ == "__main__":
+    main()
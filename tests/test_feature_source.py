@@ -0,0 +1,52 @@
+import os
+import types
+import numpy as np
+import pandas as pd
+from feature_source import DEFAULT_FEATURE_DTYPE, read_input_feature_source
+from highlights_state_selection import (compute_div_threshold, compute_states_importance, highlights_div,
+                                        read_input_files, read_q_value_files)
+from state_arrays import StateArrayWriter, state_array_filename
+from video_generation import get_key_states
+
+
+def make_stream(stream_folder, states=range(4, 64), seed=0):
+    rng = np.random.RandomState(seed)
+    os.makedirs(os.path.join(stream_folder, 'state'))
+    with StateArrayWriter(state_array_filename(os.path.join(stream_folder, 'q_values'))) as writer:
+        for state in states:
+            writer.append(state, rng.rand(1, 9).astype(np.float32))
+            np.save(os.path.join(stream_folder, 'state', 'state_' + str(state) + '.npy'), rng.rand(1, 6, 6, 4))
+
+
+def make_args(stream_folder):
+    return types.SimpleNamespace(verbose=False, workers=1, trajectories=4, context=2, minimum_gap=1,
+                                 stream_folder=stream_folder, feature_dtype=DEFAULT_FEATURE_DTYPE)
+
+
+def baseline_key_states(args, stream_folder):
+    ''' get_key_states before the feature source: float64 inputs in the features column of the dataframe '''
+    q_values_df = read_q_value_files(os.path.join(stream_folder, 'q_values'))
+    states_q_values_df = compute_states_importance(args, q_values_df, compare_to='second')
+    features_df = read_input_files(os.path.join(stream_folder, 'state'))
+    df = pd.merge(states_q_values_df[['state', 'q_values', 'importance']], features_df, on='state')
+    np.random.seed(0)
+    threshold = compute_div_threshold(df['features'].values)
+    return highlights_div(args, df, args.trajectories, args.context, args.minimum_gap, threshold=threshold)[1]
+
+
+def test_default_dtype_keeps_inputs_exact(tmp_path):
+    stream_folder = str(tmp_path)
+    make_stream(stream_folder)
+    source = read_input_feature_source(os.path.join(stream_folder, 'state'))
+    features_df = read_input_files(os.path.join(stream_folder, 'state'))
+    assert source.matrix.dtype == np.float64
+    assert np.array_equal(source.rows(np.arange(len(source))), np.stack(features_df['features'].values))
+
+
+def test_default_path_selects_baseline_states(tmp_path):
+    stream_folder = str(tmp_path)
+    make_stream(stream_folder)
+    args = make_args(stream_folder)
+    expected = baseline_key_states(args, stream_folder)
+    np.random.seed(0)
+    assert get_key_states(args, stream_folder, features='input') == expected
@@ -0,0 +1,23 @@
+import cv2
+import numpy as np
+import pytest
+from image_utils import FramePostProcessor
+
+
+def test_post_processed_frame_is_the_resized_frame():
+    frame = np.random.RandomState(0).randint(0, 255, (210, 160, 3)).astype(np.uint8)
+    post_processor = FramePostProcessor()
+    output = post_processor(frame)
+    expected = cv2.resize(frame[:210 - int(210 * 0.05)], (320, 420))
+    expected[368:, 130:221] = 0
+    assert output.shape == (500, 320, 3)
+    assert np.array_equal(output[:420], expected)
+    assert not output[368:471, 130:221].any()
+    assert not output[420:].any()
+
+
+@pytest.mark.parametrize('frame', [np.zeros((210, 160, 3), np.float32), np.zeros((210, 160), np.uint8),
+                                   np.zeros((210, 160, 4), np.uint8)])
+def test_frames_that_cannot_be_resized_into_the_output_are_rejected(frame):
+    with pytest.raises(ValueError):
+        FramePostProcessor()(frame)
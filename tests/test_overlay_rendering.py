@@ -0,0 +1,60 @@
+import os
+import types
+import cv2
+import numpy as np
+import frame_cache
+from overlay_rendering import (STYLE_FOLDERS, add_rendered_states, load_rendered_states, load_saliency_map,
+                               overlay_frames)
+from stage_cache import StageCache
+from stream_index import StreamIndex
+
+
+def make_stream(stream_folder, states=range(4, 10), seed=0):
+    rng = np.random.RandomState(seed)
+    os.makedirs(os.path.join(stream_folder, 'screen'))
+    os.makedirs(os.path.join(stream_folder, 'raw_argmax'))
+    for state in states:
+        for frame in range(4):
+            screen = rng.randint(0, 255, (210, 160, 3)).astype(np.uint8)
+            cv2.imwrite(os.path.join(stream_folder, 'screen', 'screen_%d_%d.png' % (state, frame)), screen)
+        np.save(os.path.join(stream_folder, 'raw_argmax', 'raw_argmax_%d.npy' % state), rng.rand(84, 84, 4) ** 4)
+
+
+def test_failed_frames_are_not_recorded(tmp_path):
+    stream_folder = str(tmp_path)
+    states = set(range(4, 10))
+    make_stream(stream_folder)
+    # a broken saliency map and a broken screen of a single frame
+    with open(os.path.join(stream_folder, 'raw_argmax', 'raw_argmax_6.npy'), 'w') as broken:
+        broken.write('not a saliency map')
+    with open(os.path.join(stream_folder, 'screen', 'screen_8_2.png'), 'w') as broken:
+        broken.write('not a screen')
+    args = types.SimpleNamespace(verbose=False)
+    images = [image for _, _, image in StreamIndex(stream_folder).artifact('screen').frames(states)]
+    styles = ['green', 'blur']
+
+    written = overlay_frames(args, stream_folder, images, states, styles=styles)
+    folders = ['screen_smooth'] + [STYLE_FOLDERS[style] for style in styles]
+    assert sorted(written) == sorted(folders)
+    for folder in folders:
+        assert written[folder] == states - {6, 8}
+
+    cache = StageCache(stream_folder)
+    add_rendered_states(cache, written)
+    rendered = load_rendered_states(cache, styles)
+    for folder in folders:
+        assert rendered[folder] == states - {6, 8}
+    assert os.path.exists(os.path.join(stream_folder, 'argmax_smooth', 'argmax_5_3.png'))
+    assert not os.path.exists(os.path.join(stream_folder, 'argmax_smooth', 'argmax_6_0.png'))
+
+
+def test_saliency_maps_are_cached(tmp_path):
+    stream_folder = str(tmp_path)
+    make_stream(stream_folder)
+    args = types.SimpleNamespace(verbose=False)
+    raw_argmax_base = os.path.join(stream_folder, 'raw_argmax', 'raw_argmax')
+    misses = frame_cache.stats()['misses']
+    saliency_map = load_saliency_map(args, raw_argmax_base, 5)
+    assert load_saliency_map(args, raw_argmax_base, 5) is saliency_map
+    assert frame_cache.stats()['misses'] == misses + 1
+    assert not saliency_map.flags.writeable
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from ram_tracker import RamTracker, calibrate_offsets, colour_positions
+from tracker import Tracker
+
+# (x, y) centres of Ms. Pac-Man and the four ghosts on the screen
+CENTRES = [(80, 98), (40, 20), (120, 20), (40, 140), (120, 140)]
+
+
+def record_step(centres, x_offset, y_offset):
+    ''' a screen with a block in the colour of every character and the RAM of the same step '''
+    frame = np.zeros((210, 160, 3), np.uint8)
+    # the lives below the maze have the colour of Ms. Pac-Man
+    frame[180:185, 10:20] = Tracker.pacman.lower_colour
+    ram = np.zeros(128, np.uint8)
+    for character, (x, y), x_address, y_address in zip(Tracker.CHARACTERS, centres, RamTracker.X_ADDRESSES,
+                                                        RamTracker.Y_ADDRESSES):
+        frame[y - 3:y + 4, x - 3:x + 4] = character.lower_colour
+        ram[x_address] = x - x_offset
+        ram[y_address] = y - y_offset
+    return ram, frame
+
+
+def test_colour_positions_are_the_centres_in_the_maze():
+    _, frame = record_step(CENTRES, 0, 0)
+    assert np.array_equal(colour_positions(frame, Tracker.CHARACTERS), np.array(CENTRES, float))
+
+
+def test_offsets_are_checked_against_the_screen():
+    ram, frame = record_step(CENTRES, RamTracker.X_OFFSET, RamTracker.Y_OFFSET)
+    tracker = RamTracker()
+    assert np.array_equal(tracker.position_errors(ram, frame), np.zeros((5, 2)))
+    assert tracker.check_offsets(ram, frame) is True
+    ram, frame = record_step(CENTRES, RamTracker.X_OFFSET + 8, RamTracker.Y_OFFSET)
+    assert tracker.check_offsets(ram, frame) is False
+    assert tracker.check_offsets(ram, np.zeros((210, 160, 3), np.uint8)) is None
+
+
+def test_calibrated_offsets():
+    steps = [record_step([(x + shift, y) for x, y in CENTRES], -7, 3) for shift in range(3)]
+    # a ghost that is hidden on one frame does not change the offsets
+    steps[1][1][17:24, 37:44] = 0
+    rams, frames = zip(*steps)
+    assert calibrate_offsets(rams, frames) == (-7, 3)
+    with pytest.raises(ValueError):
+        calibrate_offsets(rams[:1], [np.zeros((210, 160, 3), np.uint8)])
@@ -0,0 +1,29 @@
+import types
+from video_generation import summary_videos
+
+
+def make_args(overlay_styles):
+    return types.SimpleNamespace(trajectories=5, context=10, minimum_gap=10, overlay_styles=overlay_styles)
+
+
+def test_videos_of_the_selected_styles_only():
+    key_states = [1, 2]
+    random_states = [[3], [4]]
+    videos = summary_videos(make_args(['edge']), key_states, random_states)
+    assert videos == [
+        ('screen_smooth/', 'highlights_div_5_10_10.mp4', key_states),
+        ('edge_argmax/', 'highlights_div_edge_5_10_10.mp4', key_states),
+        ('screen_smooth/', 'random_1_5_10_10.mp4', [3]),
+        ('edge_argmax/', 'random_edge_1_5_10_10.mp4', [3]),
+        ('screen_smooth/', 'random_2_5_10_10.mp4', [4]),
+        ('edge_argmax/', 'random_edge_2_5_10_10.mp4', [4]),
+    ]
+
+
+def test_default_styles_keep_the_video_names():
+    videos = summary_videos(make_args(['green', 'blur']), [1], None)
+    assert [(folder, name) for folder, name, _ in videos] == [
+        ('screen_smooth/', 'highlights_div_5_10_10.mp4'),
+        ('argmax_smooth/', 'highlights_div_lrp_5_10_10.mp4'),
+        ('blur_argmax/', 'highlights_div_blur_5_10_10.mp4'),
+    ]
@@ -11,7 +11,7 @@
 import cv2
 #import ImageGrab
 import numpy as np
-from characters import Character
+from characters import Character, match_colours
 import math
 
 class Tracker():
@@ -54,17 +54,33 @@ class Tracker():
     FLOW = (0,0)
     SAMPLE_COUNTER = 0
     SIMILARITY_THRESHOLD = 0.75
+    # (row, column) offsets of the pixels sampled around a contour centroid: centre, left, right, above, below
+    SAMPLE_OFFSETS = np.array([[0, 0], [0, -3], [0, 3], [-3, 0], [3, 0]])
 #    POWER_PILL_LOCS = []
     BG_LOCS = []
     
-    # initialise the tracker
-    def __init__(self, history=12, sample_rate=1, pixel_offset=20, text_offset=10, flow=(0,0), sample_counter=0):
+    # initialise the tracker, create one tracker per environment and keep it for the whole rollout
+    def __init__(self, history=12, sample_rate=1, pixel_offset=20, text_offset=10, flow=(0,0), sample_counter=0, debug_every=0, debug_file='pacman.jpg'):
+        '''
+        :param debug_every: every debug_every-th frame the contours are drawn, printed and saved to debug_file, 0 never
+        '''
         self.HISTORY = history
         self.SAMPLE_RATE = sample_rate
         self.PIXEL_OFFSET = pixel_offset
         self.TEXT_OFFSET = text_offset
         self.FLOW = flow
         self.SAMPLE_COUNTER = sample_counter
+        # every tracker has its own characters and background subtractor (the class attributes are only the templates),
+        # so trackers of parallel environments do not share state
+        self.CHARACTERS = [copy_character(character) for character in Tracker.CHARACTERS]
+        self.BGS = [copy_character(bg) for bg in Tracker.BGS]
+        self.FGBG = cv2.createBackgroundSubtractorMOG2()
+        self.BG_LOCS = []
+        self.debug_every = debug_every
+        self.debug_file = debug_file
+        # working buffers, allocated for the first frame and reused
+        self.fgmask = None
+        self.edges = None
         return
         
     def close_coords(self, coord1, coord2, tol = 5):
@@ -91,8 +107,8 @@ class Tracker():
      
     # get contours from image
     def get_contours(self, image):
-        edges = cv2.Canny(image, 100, 200)
-        contours, hierarchy = cv2.findContours(edges, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+        self.edges = cv2.Canny(image, 100, 200, edges=self.edges)
+        contours, hierarchy = cv2.findContours(self.edges, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
         return contours
      
     # get contour centroid
@@ -105,6 +121,16 @@ class Tracker():
         except:
             return (0, 0)
      
+    # get the colours around the contour centroids
+    def sample_colours(self, frame, coords):
+        '''
+        gathers the colours at the SAMPLE_OFFSETS of every centroid. Like indexing the frame with frame[y][x], negative
+        indices wrap around and pixels past the bottom or right edge are black.
+        :param coords: list of (x, y) centroids
+        :return: int array of shape (len(coords), len(SAMPLE_OFFSETS), 3)
+        '''
+        return sample_colours(frame, coords, self.SAMPLE_OFFSETS)
+
     # draw contour detail on image
     def draw_contour(self, contour, image, coord, character):
         cv2.drawContours(image, [contour], -1, (0, 255, 0), 3)
@@ -142,9 +168,11 @@ class Tracker():
     def wheresPacman(self, frame):
     
         bg_counter = 0
+        debug = self.debug_every > 0 and self.SAMPLE_COUNTER % self.debug_every == 0
                 
-        fgmask = self.FGBG.apply(frame, learningRate=0.5/self.HISTORY)
-        fgoutput = cv2.cvtColor(fgmask, cv2.COLOR_GRAY2RGB)
+        self.fgmask = self.FGBG.apply(frame, fgmask=self.fgmask, learningRate=0.5/self.HISTORY)
+        fgmask = self.fgmask
+        fgoutput = cv2.cvtColor(fgmask, cv2.COLOR_GRAY2RGB) if debug else None
              
         height, width = frame.shape[:2]
 #        print("Image dimensions, H x W")
@@ -154,47 +182,34 @@ class Tracker():
         contours = self.get_contours(fgmask)
         contours = sorted(contours, key=cv2.contourArea, reverse=True)[:10]
         
+        # sample the colours of all objects and match them against all characters and the blue ghosts at once
+        coords = [self.get_contour_centroid(contour) for contour in contours]
+        samples = self.sample_colours(frame, coords)
+        matches = match_colours(samples, self.CHARACTERS + self.BGS[:1]).any(axis=1)
+
         # find characters in foreground objects
-        for contour in contours:
-            # get centre coordinates of object
-            coord = self.get_contour_centroid(contour)
-            
-            offset = 3
-            # extract colour from object
-            colour0 = frame[coord[1]][coord[0]]
-            try:
-                colour1 = frame[coord[1]][coord[0] - offset]
-            except:
-                colour1 = [0,0,0]
-            try:
-                colour2 = frame[coord[1]][coord[0] + offset]
-            except:
-                colour2 = [0,0,0]
-            try:
-                colour3 = frame[coord[1] - offset][coord[0]]
-            except:
-                colour3 = [0,0,0]
-            try:
-                colour4 = frame[coord[1] + offset][coord[0]]
-            except:
-                colour4 = [0,0,0]
+        for contour, coord, colours, contour_matches in zip(contours, coords, samples, matches):
+            colour0, colour1, colour2, colour3, colour4 = colours
             
-            print("Found color0: " + str(colour0) + " and " + str(colour1) + " and " + str(colour2) + " and " + str(colour3) + " and " + str(colour4))
+            if debug:
+                print("Found color0: " + str(colour0) + " and " + str(colour1) + " and " + str(colour2) + " and " + str(colour3) + " and " + str(colour4))
 
-            # loop all characters and attempt to match colour
-            for character in self.CHARACTERS:
-                if character.enabled and (character.is_colour_match(colour0) or character.is_colour_match(colour1) or character.is_colour_match(colour2) or character.is_colour_match(colour3) or character.is_colour_match(colour4)):
-                        print("For character: ")
-                        print(character.name)
+            # every character is assigned to the first object that matches it
+            for character, match in zip(self.CHARACTERS, contour_matches):
+                if character.enabled and match:
+                        if debug:
+                            print("For character: ")
+                            print(character.name)
                         character.set_coordinates(coord)
                         self.FLOW = self.get_flow(self.FLOW, character)
                         if (character.name == "Orange" or character.name == "Blue" or character.name == "Pink" or character.name == "Red"):
                             # set BG_LOCS to 0
                             self.BG_LOCS = []
 #                        print("Found color0: " + str(colour0) + " and " + str(colour1) + " and " + str(colour2) + " and " + str(colour3) + " and " + str(colour4))
-                        print("Coordinate: ")
-                        print(coord)
-                        self.draw_contour(contour, fgoutput, coord, character)
+                        if debug:
+                            print("Coordinate: ")
+                            print(coord)
+                            self.draw_contour(contour, fgoutput, coord, character)
                         character.direction = character.get_direction()
                         character.enabled = False
                         break
@@ -223,21 +238,24 @@ class Tracker():
 #    #                    self.draw_contour(contour, fgoutput, coord, pill)
 #                        break
             # if ghosts are blue...
-            if (self.BGS[0].is_colour_match(colour0) or self.BGS[0].is_colour_match(colour1) or self.BGS[0].is_colour_match(colour2) or self.BGS[0].is_colour_match(colour3) or self.BGS[0].is_colour_match(colour4)) and (bg_counter<4):
+            if contour_matches[-1] and (bg_counter<4):
                 bg = self.BGS[bg_counter]
-                self.draw_contour(contour, fgoutput, bg.current_coord, bg)
+                if debug:
+                    self.draw_contour(contour, fgoutput, bg.current_coord, bg)
                 bg.set_coordinates(coord)
                 self.BG_LOCS.append(np.array(coord))
-                self.draw_contour(contour, fgoutput, coord, bg)
                 self.BG_LOCS.append(coord)
-                print("Found color0: " + str(colour0) + " and " + str(colour1) + " and " + str(colour2) + " and " + str(colour3) + " and " + str(colour4))
-                print("Found ghost " + str(bg.name))
-                print("at: " + str(bg.current_coord))
+                if debug:
+                    self.draw_contour(contour, fgoutput, coord, bg)
+                    print("Found color0: " + str(colour0) + " and " + str(colour1) + " and " + str(colour2) + " and " + str(colour3) + " and " + str(colour4))
+                    print("Found ghost " + str(bg.name))
+                    print("at: " + str(bg.current_coord))
                 bg.direction = bg.get_direction()
                 bg_counter = bg_counter + 1
 #        print("BROKE OUT")
         # save image to disk
-        cv2.imwrite('pacman.jpg', fgoutput)
+        if debug:
+            cv2.imwrite(self.debug_file, fgoutput)
 
         # re-enable characters
         for character in self.CHARACTERS:
@@ -251,3 +269,26 @@ class Tracker():
         self.FLOW = (0,0)
         self.SAMPLE_COUNTER += 1
         return self.CHARACTERS, self.BGS
+
+
+def copy_character(character):
+    '''
+    :return: a new Character with the name, colour bounds and enabled flag of character
+    '''
+    return Character(character.name, list(character.lower_colour), list(character.upper_colour), character.enabled)
+
+
+def sample_colours(frame, coords, offsets):
+    '''
+    :param coords: list of (x, y) positions
+    :param offsets: array of (row, column) offsets, see Tracker.SAMPLE_OFFSETS
+    :return: int array of shape (len(coords), len(offsets), 3), see Tracker.sample_colours
+    '''
+    height, width = frame.shape[:2]
+    coords = np.asarray(coords, dtype=int).reshape(-1, 2)
+    rows = coords[:, 1, np.newaxis] + offsets[:, 0]
+    columns = coords[:, 0, np.newaxis] + offsets[:, 1]
+    inside = (rows >= -height) & (rows < height) & (columns >= -width) & (columns < width)
+    colours = frame[np.where(inside, rows, 0), np.where(inside, columns, 0)].astype(int)
+    colours[~inside] = 0
+    return colours
@@ -5,15 +5,34 @@
 import coloredlogs, logging
 import pandas as pd
 import image_utils
+import frame_cache
 import numpy as np
 import sys
-from highlights_state_selection import read_q_value_files, read_feature_files, compute_states_importance, highlights_div, random_state_selection, read_input_files
+from highlights_state_selection import read_q_value_files, read_feature_files, compute_states_importance, compute_div_threshold, highlights_div, random_state_selection, read_input_files, merge_importance_order
 import os
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from state_arrays import write_state_table, read_state_table, state_array_filename, records_end
+from stage_cache import StageCache, path_manifest, stage_key, prefix_fingerprint, has_prefix
+from feature_source import read_input_feature_source, open_feature_source
+from overlay_rendering import STYLE_FOLDERS, DEFAULT_OVERLAY_STYLES
+
+#states are compared by their network input in the HIGHLIGHTS-DIV summary (see get_key_states)
+SUMMARY_FEATURES = 'input'
 
 #random seeds for the random summaries
 seeds=[ 42, 1337, 1, 7, 13, 21, 153, 90,19234761, 291857957]
 
+#intermediate tables of get_key_states, q_values and features are FixedSizeList<float32> columns (see state_arrays)
+STATES_IMPORTANCE_FILE = 'states_importance_second.parquet'
+STATE_FEATURES_IMPORTANCE_FILE = 'state_features_importance.parquet'
+
+#video name prefixes of the HIGHLIGHTS-DIV summary and of every random summary
+HIGHLIGHTS_VIDEO_PREFIX = 'highlights_div_'
+RANDOM_VIDEO_PREFIX = 'random_'
+#part of the video name for every overlay style (see overlay_rendering.STYLE_FOLDERS), the smoothed screens have none
+STYLE_VIDEO_PREFIXES = {'green': 'lrp_', 'blur': 'blur_', 'edge': 'edge_'}
+
 
 
 def print_df(stats_df):
@@ -21,8 +40,20 @@ def print_df(stats_df):
     with pd.option_context('display.max_rows', None, 'display.max_columns', None):  # more options can be specified also
         print(stats_df)
         
-# help_function(args, stream_folder, random_states_with_context, key_states = image_indices)
-def help_function(args, stream_folder, key_states):
+def video_types(args, summary_prefix):
+    '''
+    :param summary_prefix: HIGHLIGHTS_VIDEO_PREFIX or RANDOM_VIDEO_PREFIX
+    :return: list of (image folder, video name prefix) of the videos of a summary, one for the smoothed screens and one
+    for every overlay style in args.overlay_styles
+    '''
+    styles = getattr(args, 'overlay_styles', None) or DEFAULT_OVERLAY_STYLES
+    types = [('screen_smooth/', summary_prefix)]
+    for style in styles:
+        types.append((STYLE_FOLDERS[style] + '/', summary_prefix + STYLE_VIDEO_PREFIXES[style]))
+    return types
+
+
+def help_function(args, stream_folder, key_states, random_states_with_context=None):
     logger = logging.getLogger()
     coloredlogs.install(level='DEBUG', fmt='%(asctime)s,%(msecs)03d %(filename)s[%(process)d] %(levelname)s %(message)s')
 
@@ -30,75 +61,118 @@ def help_function(args, stream_folder, key_states):
     print("In help function of video_generation.py")
     parameter_string = make_parameter_string(args)
     video_folder = os.path.join(stream_folder,'smooth_stream_vid_max/')
+
+    if getattr(args, 'segment_videos', False):
+        if image_utils.segment_encoding_supported(args):
+            generate_segmented_videos(args, stream_folder, key_states, random_states_with_context)
+            return
+        logger.warning("Encoding the videos in segments needs ffmpeg, encoding every video in one pass")
     
+    highlights_types = video_types(args, HIGHLIGHTS_VIDEO_PREFIX)
     if args.verbose:
-        logger.info("Making highlights video")
-    print("Making highlights video")
-    image_folder = os.path.join(stream_folder, 'screen_smooth/')
-    video_name = 'highlights_div_' + parameter_string + '.mp4'
-    image_utils.generate_video(args, image_folder, video_folder, video_name,
-                           image_indices=key_states)
-                               
-    if args.verbose:
-        logger.info("Making highlights LRP video")
-    print("Making highlights LRP video")
-    image_folder = os.path.join(stream_folder, 'argmax_smooth/')
-    video_name = 'highlights_div_lrp_' + parameter_string + '.mp4'
-    image_utils.generate_video(args, image_folder, video_folder, video_name,
-                               image_indices=key_states)
-    
+        logger.info("Making highlights videos of " + ", ".join(image_folder for image_folder, _ in highlights_types))
+    print("Making highlights videos")
+    image_utils.generate_videos(args, [os.path.join(stream_folder, image_folder) for image_folder, _ in highlights_types],
+                                video_folder, [video_prefix + parameter_string + '.mp4' for _, video_prefix in highlights_types],
+                                image_indices=key_states)
+
+    if random_states_with_context:
+        generate_random_videos(args, stream_folder, random_states_with_context)
+
+
+def generate_random_videos(args, stream_folder, random_states_with_context):
+    ''' renders the videos of all random summaries, encoding the videos of each summary in its own worker process.
+    The overlays for all random states have to exist already (see overlay_stream.get_random_states_list).
+    :param random_states_with_context: list with the summary states (includes the context) per seed
+    '''
+    logger = logging.getLogger()
+    parameter_string = make_parameter_string(args)
+    video_folder = os.path.join(stream_folder,'smooth_stream_vid_max/')
     if args.verbose:
-        logger.info("Making highlights blur video")
-    print("Making highlights blur video")
-    image_folder = os.path.join(stream_folder, 'blur_argmax/')
-    video_name = 'highlights_div_blur_' + parameter_string + '.mp4'
-    image_utils.generate_video(args, image_folder, video_folder, video_name,
-                               image_indices=key_states)
-                               
-#    counter = 0
-#    for random_state_set in random_states_with_context:
-#        if args.verbose:
-#            logger.info("Cycling through the pre-generated list of random states to make random movies.")
-#            logger.info("Starting with saliency maps")
-#            print("Starting with random saliency maps")
-#        image_folder = os.path.join(stream_folder, 'argmax_smooth/')
-#        video_name = 'random_lrp_' + str(counter+1) + '_' + parameter_string + '.mp4'
-#        image_utils.generate_video(args, image_folder, video_folder, video_name,
-#                                   image_indices=random_state_set)
-#
-#        if args.verbose:
-#            logger.info("And making normal video.")
-#        image_folder = os.path.join(stream_folder, 'screen_smooth/')
-#        video_name = 'random_' + str(counter+1) + '_' + parameter_string + '.mp4'
-#        image_utils.generate_video(args, image_folder, video_folder, video_name,
-#                                   image_indices=random_state_set)
-#
-#        if args.verbose:
-#            logger.info("Now making random blurred video. Sounds less useful than it is...")
-#            print("Random blurred video")
-#        image_folder = os.path.join(stream_folder, 'blur_argmax/')
-#        video_name = 'random_blur_' + str(counter+1) + '_' + parameter_string + '.mp4'
-#        image_utils.generate_video(args, image_folder, video_folder, video_name,
-#                                   image_indices=random_state_set)
-#        counter = counter + 1
-
-    #
-
-    #        for i in range(10):
-    #            seed = seeds[i]
-    #            random_states, random_states_with_args.context = random_state_selection(state_features_importance_df,
-    #                                                                               args.trajectories,
-    #                                                                               args.context, args.minimum_gap,seed=seed)
-    #
-    #            image_folder = os.path.join(stream_folder, 'argmax_smooth/')
-    #            video_name = 'random_lrp_' + str(i+1) + '_' + parameter_string + '.mp4'
-    #            image_utils.generate_video(args, image_folder, video_folder, video_name,
-    #                                       image_indices=random_states_with_args.context)
-    #
-    #            image_folder = os.path.join(stream_folder, 'screen_smooth/')
-    #            video_name = 'random_' + str(i+1) + '_' + parameter_string + '.mp4'
-    #            image_utils.generate_video(args, image_folder, video_folder, video_name,
-    #                                       image_indices=random_states_with_args.context)
+        logger.info("Making " + str(len(random_states_with_context)) + " random summaries with " + str(args.workers) + " workers")
+
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=frame_cache.configure,
+                             initargs=(frame_cache.worker_budget(args.workers),)) as executor:
+        futures = []
+        random_types = video_types(args, RANDOM_VIDEO_PREFIX)
+        for counter, random_state_set in enumerate(random_states_with_context):
+            image_folders = [os.path.join(stream_folder, image_folder) for image_folder, _ in random_types]
+            video_names = [video_prefix + str(counter+1) + '_' + parameter_string + '.mp4' for _, video_prefix in random_types]
+            futures.append(executor.submit(image_utils.generate_videos, args, image_folders, video_folder, video_names,
+                                           image_indices=random_state_set))
+        for future in futures:
+            future.result()
+
+
+def generate_segmented_videos(args, stream_folder, key_states, random_states_with_context=None):
+    ''' renders all videos of a stream by encoding every trajectory of every summary in its own worker process. The
+    segments of each video are concatenated without re-encoding (see image_utils.concat_videos), which needs ffmpeg.
+    :param key_states: the HIGHLIGHTS-DIV summary states (includes the context)
+    :param random_states_with_context: list with the summary states (includes the context) per seed
+    '''
+    logger = logging.getLogger()
+    parameter_string = make_parameter_string(args)
+    video_folder = os.path.join(stream_folder,'smooth_stream_vid_max/')
+    summaries = [(video_types(args, HIGHLIGHTS_VIDEO_PREFIX), '', key_states)]
+    for counter, random_state_set in enumerate(random_states_with_context or []):
+        summaries.append((video_types(args, RANDOM_VIDEO_PREFIX), str(counter+1) + '_', random_state_set))
+
+    concatenations = []
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=frame_cache.configure,
+                             initargs=(frame_cache.worker_budget(args.workers),)) as executor:
+        futures = []
+        for video_types, counter_string, states in summaries:
+            image_folders = [os.path.join(stream_folder, image_folder) for image_folder, _ in video_types]
+            video_names = [video_prefix + counter_string + parameter_string + '.mp4' for _, video_prefix in video_types]
+            segments = image_utils.summary_segments(image_folders, states)
+            if not segments:
+                futures.append(executor.submit(image_utils.generate_videos, args, image_folders, video_folder, video_names,
+                                               image_indices=states))
+                continue
+            for segment_number, segment in enumerate(segments):
+                segment_names = [image_utils.segment_filename(video_name, segment_number) for video_name in video_names]
+                futures.append(executor.submit(image_utils.generate_videos, args, image_folders, video_folder,
+                                               segment_names, image_indices=segment,
+                                               leading_black_frames=segment_number > 0))
+            for video_name in video_names:
+                concatenations.append(([os.path.join(video_folder, image_utils.segment_filename(video_name, segment_number))
+                                        for segment_number in range(len(segments))], os.path.join(video_folder, video_name)))
+        if args.verbose:
+            logger.info("Encoding " + str(len(futures)) + " segments with " + str(args.workers) + " workers")
+        for future in futures:
+            future.result()
+    for segment_filenames, filename in concatenations:
+        image_utils.concat_videos(segment_filenames, filename)
+
+
+def summary_videos(args, key_states, random_states_with_context=None):
+    ''' lists all videos of a stream
+    :param key_states: the HIGHLIGHTS-DIV summary states (includes the context)
+    :param random_states_with_context: list with the summary states (includes the context) per seed
+    :return: list of (image folder, video name, summary states) with the same names help_function uses
+    '''
+    parameter_string = make_parameter_string(args)
+    videos = [(image_folder, video_prefix + parameter_string + '.mp4', key_states)
+              for image_folder, video_prefix in video_types(args, HIGHLIGHTS_VIDEO_PREFIX)]
+    for counter, random_state_set in enumerate(random_states_with_context or []):
+        for image_folder, video_prefix in video_types(args, RANDOM_VIDEO_PREFIX):
+            videos.append((image_folder, video_prefix + str(counter+1) + '_' + parameter_string + '.mp4', random_state_set))
+    return videos
+
+
+def open_summary_videos(args, stream_folder, key_states, random_states_with_context=None):
+    ''' opens an encoder for every video of summary_videos, for rendering the overlays straight into the videos
+    :return: dict image folder -> list of image_utils.SummaryVideoWriter
+    '''
+    video_folder = os.path.join(stream_folder,'smooth_stream_vid_max/')
+    if not (os.path.isdir(video_folder)):
+        os.makedirs(video_folder)
+    videos = {}
+    for image_folder, video_name, states in summary_videos(args, key_states, random_states_with_context):
+        videos.setdefault(image_folder.rstrip('/'), []).append(
+            image_utils.SummaryVideoWriter(os.path.join(video_folder, video_name), states=states,
+                                           encoder_options=image_utils.video_encoder_options(args)))
+    return videos
 
 
 def make_parameter_string(args):
@@ -106,81 +180,187 @@ def make_parameter_string(args):
     return parameter_string
  
     
-# help_function(args, stream_folder, random_states_with_context, key_states = image_indices)
+def save_latest_importance(cache, states_q_values_df, importance_order, fingerprint):
+    ''' stores the importance table and order of update_importance as one entry, the order as importance_rank column.
+    An interrupted run (e.g. a terminated preview process) therefore never leaves an order behind that misses states of
+    the table. The fingerprint of the q values file is written last.
+    '''
+    rank = pd.Series(np.arange(len(importance_order)), index=importance_order)
+    latest_df = states_q_values_df.assign(importance_rank=rank.loc[states_q_values_df['state'].values].values)
+    cache.save_table('importance', 'latest', latest_df)
+    cache.save('importance_fingerprint', 'latest', fingerprint)
+
+
+def load_latest_importance(cache):
+    ''' :return: the table and order stored by save_latest_importance, or None, None if there is no entry or its order
+    is not a ranking of exactly the states of the table
+    '''
+    latest_df = cache.load_table('importance', 'latest')
+    if latest_df is None or 'importance_rank' not in latest_df.columns:
+        return None, None
+    ranks = latest_df['importance_rank'].values
+    if not np.array_equal(np.sort(ranks), np.arange(len(latest_df))):
+        return None, None
+    importance_order = latest_df['state'].values[np.argsort(ranks)]
+    if set(importance_order.tolist()) != set(latest_df['state'].tolist()):
+        return None, None
+    return latest_df.drop(columns=['importance_rank']), importance_order
+
+
+def update_importance(args, cache, q_values_path):
+    ''' computes the importance of all states of a stream. Streams only grow by appending states, so the importance of
+    the states that are in the latest cached importance table is reused and only new states are computed. The table is
+    only reused while the q values file still starts with the records it was computed from, a stream that was generated
+    again in place (or has no consolidated q values file) is computed from scratch.
+    :param cache: StageCache of the stream
+    :param q_values_path: path to the q values of the stream
+    :return: dataframe with state, q_values and importance sorted by state, and the states sorted by decreasing importance
+    '''
+    logger = logging.getLogger()
+    q_values_df = read_q_value_files(q_values_path, workers=args.workers)
+    q_values_filename = state_array_filename(q_values_path)
+    fingerprint = None
+    if os.path.exists(q_values_filename):
+        fingerprint = prefix_fingerprint(q_values_filename, records_end(q_values_filename, len(q_values_df)))
+    previous_df, previous_order = None, None
+    previous_fingerprint = cache.load('importance_fingerprint', 'latest')
+    if previous_fingerprint is not None and has_prefix(q_values_filename, previous_fingerprint):
+        previous_df, previous_order = load_latest_importance(cache)
+    if previous_df is not None and previous_order is not None:
+        q_values_df = q_values_df[~q_values_df['state'].isin(previous_df['state'])].reset_index(drop=True)
+        if args.verbose:
+            logger.info("Reusing the importance of " + str(len(previous_df)) + " states, computing " + str(len(q_values_df)) + " new states")
+    if args.verbose:
+        logger.info("Vid Gen and q_values_df is: ")
+        print_df(q_values_df)
+    if len(q_values_df) > 0:
+        print("Calling compute state imortance")
+        new_df = compute_states_importance(args, q_values_df, compare_to='second')[['state', 'q_values', 'importance']]
+    else:
+        new_df = q_values_df.assign(importance=pd.Series(dtype=float))[['state', 'q_values', 'importance']]
+
+    if previous_df is None or previous_order is None:
+        states_q_values_df = new_df
+        importance_order = new_df.sort_values(['importance'], ascending=False)['state'].values
+    else:
+        states_q_values_df = pd.concat([previous_df, new_df]).sort_values('state', kind='stable').reset_index(drop=True)
+        previous_importance = previous_df.set_index('state')['importance'].loc[previous_order].values
+        importance_order, _ = merge_importance_order(previous_order, previous_importance,
+                                                     new_df['state'].values, new_df['importance'].values.astype(float))
+    save_latest_importance(cache, states_q_values_df, importance_order, fingerprint)
+    return states_q_values_df, importance_order
+
+
 def get_key_states(args, stream_folder, features='input', load_states=False):
+    ''' computes the HIGHLIGHTS-DIV summary of a stream.
+    The importance, the div-threshold and the summary are cached (see stage_cache) under keys of their input files and
+    parameters, so only the stages whose inputs changed are recomputed. When the stream grew, only the new states are
+    ingested and their importance computed, and they are merged into the cached importance order (see update_importance).
+    :param features: 'input' to compare states by the network input, 'features' to use the second to last layer
+    :return: list of the summary states including their context
+    '''
     logger = logging.getLogger()
     coloredlogs.install(level='DEBUG', fmt='%(asctime)s,%(msecs)03d %(filename)s[%(process)d] %(levelname)s %(message)s')
 
     logger.setLevel(logging.DEBUG)
     
     np.set_printoptions(threshold=sys.maxsize)
-    if not (os.path.exists(stream_folder + '/summary_states_with_context.npy')):
-        if args.verbose:
-            logger.info("In Get key states and summary States file does not exist")
-        parameter_string = make_parameter_string(args)
-        
+    if features == 'features':
+        features_path = stream_folder + '/features'
+        features_manifest = path_manifest(state_array_filename(features_path)) or path_manifest(features_path, '.txt')
+    elif features == 'input':
+        features_path = stream_folder + '/state'
+        features_manifest = path_manifest(features_path, '.npy')
+    else:
+        logger.error('feature type not support.')
+        return None
+    q_values_path = stream_folder + '/q_values'
+    q_values_manifest = path_manifest(state_array_filename(q_values_path)) or path_manifest(q_values_path)
 
-        q_values_df = read_q_value_files(stream_folder + '/q_values')
-        if args.verbose:
-            logger.info("Vid Gen and q_values_df is: ")
-            print_df(q_values_df)
-        print("Calling compute state imortance")
-        states_q_values_df = compute_states_importance(args, q_values_df, compare_to='second')
-        states_q_values_df.to_csv(stream_folder + '/states_importance_second.csv')
-        states_q_values_df = pd.read_csv(stream_folder + '/states_importance_second.csv')
+    cache = StageCache(stream_folder)
+    importance_key = stage_key('importance', q_values_manifest, 'second')
+    threshold_key = stage_key('threshold', importance_key, features, features_manifest, args.feature_dtype)
+    summary_key = stage_key('summary', threshold_key, args.trajectories, args.context, args.minimum_gap)
+
+    summary = cache.load('summary', summary_key)
+    if summary is not None:
+        print("In get key states and the summary for these inputs and parameters is cached")
+        summary_states = summary['summary_states']
+        summary_states_with_context = summary['summary_states_with_context']
+    else:
         if args.verbose:
-            logger.info("Vid Gen and q_values_df is: ")
-            print_df(q_values_df)
-        if features == 'features':
-            features_df = read_feature_files(stream_folder + '/features')
-            features_df.to_csv(stream_folder + '/state_features.csv')
-            features_df = pd.read_csv(stream_folder + '/state_features.csv')
-            if args.verbose:
-                logger.info("Vid Gen and q_values_df is: ")
-                print_df(q_values_df)
+            logger.info("In Get key states and no summary is cached for these inputs and parameters")
+        feature_source = None
+
+        states_q_values_df = cache.load_table('importance', importance_key)
+        importance_order = cache.load_array('importance_order', importance_key)
+        if states_q_values_df is None or importance_order is None:
+            states_q_values_df, importance_order = update_importance(args, cache, q_values_path)
+            write_state_table(states_q_values_df, os.path.join(stream_folder, STATES_IMPORTANCE_FILE))
+            cache.save_table('importance', importance_key, states_q_values_df)
+            cache.save_array('importance_order', importance_key, importance_order)
+        elif args.verbose:
+            logger.info("Using cached importance")
+        if features == 'features' and os.path.exists(state_array_filename(features_path)):
+            # memory-mapped, so only the features highlights_div compares are read
+            feature_source = open_feature_source(state_array_filename(features_path))
+            state_features_importance_df = states_q_values_df[states_q_values_df['state'].isin(feature_source.states)]
+            state_features_importance_df = state_features_importance_df.reset_index(drop=True)
+            state_features = feature_source.subset(state_features_importance_df['state'].values)
+        elif features == 'features':
+            features_df = read_feature_files(features_path, workers=args.workers)
             state_features_importance_df = pd.merge(states_q_values_df, features_df, on='state')
             state_features_importance_df = state_features_importance_df[['state', 'q_values', 'importance', 'features']]
-            state_features_importance_df.to_csv(stream_folder + '/state_features_importance.csv')
-            state_features_importance_df = pd.read_csv(stream_folder + '/state_features_importance.csv')
-
-            state_features_importance_df['features'] = state_features_importance_df['features'].apply(lambda x:
-                                                                                                      np.fromstring(
-                                                                                                          x.replace('\n', '')
-                                                                                                              .replace('[', '')
-                                                                                                              .replace(']', '')
-                                                                                                              .replace('  ',
-                                                                                                                       ' '),
-                                                                                                          sep=' '))
-        elif features == 'input': #we need an extra case since the input arrays are too big to be saved in csv.
+            state_features = state_features_importance_df['features'].values
+        else:
             if args.verbose:
                 logger.info("Features set to input, creating state_features_importance_df")
-            np.set_printoptions(threshold=sys.maxsize)
-            features_df = read_input_files(stream_folder + '/state')
+            # the inputs are too big to be kept in the dataframe, highlights_div reads them lazily from the feature source
+            feature_source = read_input_feature_source(features_path, dtype=args.feature_dtype, workers=args.workers)
             
-            features_df.to_csv(stream_folder + '/read_in_features.csv')
-            state_features_importance_df = pd.merge(states_q_values_df, features_df, on='state')
-            state_features_importance_df = state_features_importance_df[['state', 'q_values', 'importance', 'features']]
-            state_features_importance_df.to_csv(stream_folder + '/state_features_importance.csv')
-        else:
-            logger.error('feature type not support.')
+            state_features_importance_df = states_q_values_df[states_q_values_df['state'].isin(feature_source.states)]
+            state_features_importance_df = state_features_importance_df.reset_index(drop=True)
+            state_features = feature_source.subset(state_features_importance_df['state'].values)
+        write_state_table(state_features_importance_df, os.path.join(stream_folder, STATE_FEATURES_IMPORTANCE_FILE))
+
+        threshold = cache.load('threshold', threshold_key)
+        if threshold is None:
+            threshold = float(compute_div_threshold(state_features))
+            cache.save('threshold', threshold_key, threshold)
+        elif args.verbose:
+            logger.info("Using cached threshold")
         
         if args.verbose:
             logger.info("About to call Highlights DIV algorithm from get_key_states")
-        summary_states, summary_states_with_context = highlights_div(args, state_features_importance_df, args.trajectories, args.context, args.minimum_gap)
-        np.save(stream_folder + '/summary_states.npy', summary_states)
-        np.save(stream_folder + '/summary_states_with_context.npy', summary_states_with_context)
+        summary_states, summary_states_with_context = highlights_div(args, state_features_importance_df, args.trajectories, args.context, args.minimum_gap, feature_source=feature_source, threshold=threshold, sorted_states=importance_order)
+        summary_states = [int(state) for state in summary_states]
+        summary_states_with_context = [int(state) for state in summary_states_with_context]
+        cache.save('summary', summary_key, {'summary_states': summary_states,
+                                            'summary_states_with_context': summary_states_with_context})
         if args.verbose:
             logger.info("Key states before return from get key states: ")
             logger.info(summary_states)
             logger.info("With context: ")
             logger.info(summary_states_with_context)
-    else:
-        print("In get key states and summary states file already exists")
-        summary_states_with_context = np.load(stream_folder + '/summary_states_with_context.npy')
+    # the latest summary, for tools that read the npy files
+    np.save(stream_folder + '/summary_states.npy', summary_states)
+    np.save(stream_folder + '/summary_states_with_context.npy', summary_states_with_context)
         
     return summary_states_with_context
     
-def generate_videos(args, random_states_with_context):
+def read_state_features_importance(stream_folder, columns=None):
+    ''' loads the state_features_importance table written by get_key_states
+    :param stream_folder: folder of the stream
+    :param columns: columns to read, e.g. ['state', 'importance'] when the features are not needed
+    :return: dataframe with the requested columns
+    '''
+    filename = os.path.join(stream_folder, STATE_FEATURES_IMPORTANCE_FILE)
+    if os.path.exists(filename):
+        return read_state_table(filename, columns=columns)
+    # streams processed before the tables were stored as Parquet
+    return pd.read_csv(os.path.join(stream_folder, 'state_features_importance.csv'), usecols=columns)
+    
+def generate_videos(args, random_states_with_context=None):
     stream_folder = args.stream_folder
     print("Calling get key states")
     image_indices = get_key_states(args, stream_folder, load_states = False)
@@ -201,7 +381,7 @@ def generate_videos(args, random_states_with_context):
 #    ls = [type(item) for item in random_states_with_context]
 #    print("Type of random list:")
 #    print(ls)
-    help_function(args, stream_folder, key_states = image_indices)
+    help_function(args, stream_folder, key_states = image_indices, random_states_with_context = random_states_with_context)
 
 if __name__ == '__main__':
     generate_videos(args)